@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Benchmarks for Ravenglass. Run `./bench.py --help` for the list; each
+# benchmark exits with a non-zero status if it exceeds its budget so that it
+# can guard against regressions.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that should only be imported by the commands that use them
+HEAVY_MODULES = [ "flask", "requests", "Foundation", "AppKit", "sqlite3", "webapi", "webauth", "interapp" ]
+
+STARTUP_COMMANDS = [
+        [ "--help" ],
+        [ "cache", "--help" ],
+        [ "--player", "simulated", "what" ],
+        [ "--player", "simulated", "what", "--json" ],
+        ]
+
+# Runs rg.py in a fresh interpreter and reports which heavy modules it loaded
+PROBE = """
+import contextlib, io, json, runpy, sys
+rg, heavy, argv = sys.argv[1], json.loads(sys.argv[2]), json.loads(sys.argv[3])
+sys.argv = [ rg ] + argv
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path(rg, run_name="__main__")
+    except SystemExit:
+        pass
+print(json.dumps(sorted(m for m in heavy if m in sys.modules)))
+"""
+
+def write_config(config_dir):
+    with open(os.path.join(config_dir, "config.ini"), "w") as f:
+        f.write("[WEB_API]\nCLIENT_ID = benchmark\nCLIENT_SECRET = benchmark\n")
+
+def best_runtime(command, runs):
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(perf_counter() - start)
+    return min(times)
+
+def loaded_modules(argv):
+    res = subprocess.run([ sys.executable, "-c", PROBE, os.path.join(HERE, "rg.py"), json.dumps(HEAVY_MODULES), json.dumps(argv) ],
+                         capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+def bench_startup(args):
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir)
+        interpreter = best_runtime([ sys.executable, "-c", "pass" ], args.runs)
+
+        failed = False
+        print("%-40s %10s  %s" % ("command", "best ms", "heavy modules"))
+        print("%-40s %10.1f" % ("(python -c pass)", interpreter * 1000))
+        for command in STARTUP_COMMANDS:
+            argv = [ "-c", config_dir ] + command
+            best = best_runtime([ sys.executable, os.path.join(HERE, "rg.py") ] + argv, args.runs)
+            heavy = loaded_modules(argv)
+            over = (best - interpreter) * 1000 > args.max_ms or heavy
+            failed = failed or over
+            print("%-40s %10.1f  %s%s" % (" ".join(command), best * 1000, ", ".join(heavy) or "-", "  FAIL" if over else ""))
+        return 1 if failed else 0
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+# Runs |run| (after |prepare|, which isn't timed) and returns its wall time,
+# the number of tracks it handled and, with |memory|, the peak traced
+# allocation from a second run. Tracing slows Python down a lot, so the times
+# come from the untraced run.
+def measure(prepare, run, memory):
+    prepare()
+    start = perf_counter()
+    items = run()
+    elapsed = perf_counter() - start
+    peak = None
+    if memory:
+        prepare()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, items, peak
+
+# A WebApi signed in to the stub, with its config in |config_dir|. The stub's
+# address has to be in the environment before webapi is first imported.
+def stub_webapi(config_dir, http):
+    import stubapi, webapi, webauth
+    from configparser import ConfigParser
+    write_config(config_dir)
+    with open(os.path.join(config_dir, "usertoken.txt"), "w") as f:
+        f.write(stubapi.INITIAL_TOKEN + "\n" + stubapi.REFRESH_TOKEN)
+    config = ConfigParser()
+    config.read(os.path.join(config_dir, "config.ini"))
+    return webapi.WebApi(webauth.WebAuth(config, config_dir, http), http)
+
+# Times the API operations against stubapi.py for each library size
+def bench_api(args):
+    import stubapi
+    server = stubapi.StubServer(stubapi.StubState([])).start()
+    os.environ["RAVENGLASS_API_ROOT"] = server.api_root()
+    os.environ["RAVENGLASS_ACCOUNTS_ROOT"] = server.accounts_root()
+    import library, query, ratelimit, songfmt, transport
+
+    failed = False
+    for size in args.tracks:
+        state = stubapi.StubState(stubapi.synthetic_library(size), args.latency, args.token_ttl, args.rate_limit)
+        server.state = state
+        with tempfile.TemporaryDirectory() as config_dir:
+            http = transport.Transport(limiter=ratelimit.RateLimiter(rate=args.rate, burst=args.jobs * 2, max_rate=args.max_rate))
+            latencies = []
+            send = http.session.request
+            def timed(*a, **kw):
+                start = perf_counter()
+                try:
+                    return send(*a, **kw)
+                finally:
+                    latencies.append(perf_counter() - start)
+            http.session.request = timed
+            api = stub_webapi(config_dir, http)
+            store = library.LibraryStore(os.path.join(config_dir, "library.db"))
+            uris = [ item["track"]["uri"] for item in state.library[:args.playlist] ]
+            newest = [ item["track"]["id"] for item in state.library[:100] ]
+            width = 120
+
+            def cache():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    api.cache_library(os.path.join(config_dir, "library.jsonl.gz"), args.jobs, store)
+                return store.count()
+
+            def forget_newest():
+                store.delete(newest)
+
+            def update():
+                return len(api.update_library(store, jobs=args.jobs))
+
+            def format_all():
+                tracks = store.tracks()
+                for track in tracks:
+                    songfmt.format_song(track, width, include_time=False, include_pos=False)
+                return len(tracks)
+
+            def singles():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    api.create_singles_playlist(1, "Benchmark", store, jobs=args.jobs)
+                return len(query.singles(store, 1))
+
+            def playlist():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    api.create_playlist("Benchmark", uris, jobs=args.jobs)
+                return len(uris)
+
+            nothing = lambda: None
+            operations = [
+                    ("fetch_library", nothing, lambda: len(api.fetch_library())),
+                    ("fetch_library -j%d" % args.jobs, nothing, lambda: len(api.fetch_library(jobs=args.jobs))),
+                    ("cache_library", nothing, cache),
+                    ("update_library", forget_newest, update),
+                    ("create_playlist", nothing, playlist),
+                    ("create_singles_playlist", nothing, singles),
+                    ("format_song", nothing, format_all),
+                    ]
+
+            print("%d tracks" % size)
+            print("  %-26s %9s %9s %8s %8s %8s %9s" % ("operation", "seconds", "tracks/s", "requests", "p50 ms", "p95 ms", "peak MB"))
+            for name, prepare, run in operations:
+                latencies.clear()
+                before = state.requests
+                try:
+                    elapsed, items, peak = measure(prepare, run, args.memory)
+                except Exception as e:
+                    print("  %-26s FAILED %s: %s" % (name, type(e).__name__, e))
+                    failed = True
+                    continue
+                requests = (state.requests - before) // (2 if args.memory else 1)
+                timings = latencies[:len(latencies) // (2 if args.memory else 1)]
+                print("  %-26s %9.3f %9.0f %8d %8.1f %8.1f %9s" % (name, elapsed, items / elapsed if elapsed else 0, requests,
+                      percentile(timings, 0.5) * 1000, percentile(timings, 0.95) * 1000,
+                      "%.1f" % (peak / 2**20) if peak is not None else "-"))
+            print("  (stub saw %d requests: %d unauthorised, %d throttled)" % (state.requests, state.unauthorised, state.throttled))
+            store.close()
+    server.shutdown()
+    return 1 if failed else 0
+
+# Positions unsaved for each reconcile case; negative ones count from the end
+RECONCILE_CASES = [
+        ("top", [ 0 ]),
+        ("top two", [ 0, 1 ]),
+        ("middle of a page", [ 5 ]),
+        ("page boundary", [ 49, 50 ]),
+        ("two pages apart", [ 100, 300 ]),
+        ("tail", [ -1 ]),
+        ("top, middle and tail", [ 0, 250, -1 ]),
+        ]
+
+# Unsaves songs on the stub and checks that reconcile_library finds exactly
+# those, reporting how many requests it took
+def bench_reconcile(args):
+    import stubapi
+    server = stubapi.StubServer(stubapi.StubState([])).start()
+    os.environ["RAVENGLASS_API_ROOT"] = server.api_root()
+    os.environ["RAVENGLASS_ACCOUNTS_ROOT"] = server.accounts_root()
+    import library, ratelimit, transport
+    from track import Track
+
+    failed = False
+    print("%-26s %8s %8s  %s" % ("unsaved", "removed", "requests", "result"))
+    for name, positions in RECONCILE_CASES:
+        state = stubapi.StubState(stubapi.synthetic_library(args.tracks))
+        server.state = state
+        with tempfile.TemporaryDirectory() as config_dir:
+            http = transport.Transport(limiter=ratelimit.RateLimiter(rate=1000, burst=10, max_rate=1000))
+            api = stub_webapi(config_dir, http)
+            store = library.LibraryStore(os.path.join(config_dir, "library.db"))
+            store.upsert([ Track.from_saved_track(item, keep_raw=True) for item in state.library ])
+            unsaved = { state.library[p]["track"]["id"] for p in positions }
+            with state.lock:
+                state.library[:] = [ item for item in state.library if item["track"]["id"] not in unsaved ]
+                for i in unsaved:
+                    del state.saved[i]
+            before = state.requests
+            removed = api.reconcile_library(store)
+            requests = state.requests - before
+            ok = set(removed) == unsaved and store.count() == len(state.library)
+            failed = failed or not ok
+            print("%-26s %8d %8d  %s" % (name, len(removed), requests, "ok" if ok else
+                  "FAIL: expected %d, store has %d of %d" % (len(unsaved), store.count(), len(state.library))))
+            store.close()
+    server.shutdown()
+    return 1 if failed else 0
+
+BENCHMARKS = {
+        "startup": bench_startup,
+        "api": bench_api,
+        "reconcile": bench_reconcile
+        }
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench", description="Ravenglass benchmarks")
+    subparsers = parser.add_subparsers(help="Benchmarks", dest="benchmark")
+
+    startup_parser = subparsers.add_parser("startup", help="Time rg.py startup and check it stays lazy")
+    startup_parser.add_argument("--runs", default=10, type=int, help="Runs per command")
+    startup_parser.add_argument("--max-ms", default=150, type=float, help="Budget per command above bare interpreter startup")
+
+    api_parser = subparsers.add_parser("api", help="Time API operations against a local stub of the Web API")
+    api_parser.add_argument("--tracks", default=[ 1000, 10000 ], type=int, nargs="+", help="Library sizes to run with")
+    api_parser.add_argument("--latency", default=0.0, type=float, help="Seconds the stub adds to every request")
+    api_parser.add_argument("--token-ttl", default=None, type=float, help="Seconds before the stub's access tokens stop working")
+    api_parser.add_argument("--rate-limit", default=None, type=int, help="Requests per second before the stub answers 429")
+    api_parser.add_argument("--rate", default=1000, type=float, help="Requests per second that Ravenglass starts pacing at")
+    api_parser.add_argument("--max-rate", default=1000, type=float, help="Requests per second that Ravenglass may speed up to")
+    api_parser.add_argument("-j", "--jobs", default=4, type=int, help="Parallel requests, where supported")
+    api_parser.add_argument("--playlist", default=1000, type=int, help="Number of tracks in the playlist to create")
+    api_parser.add_argument("--memory", action="store_true", help="Also measure peak memory (runs every operation twice)")
+
+    reconcile_parser = subparsers.add_parser("reconcile", help="Check that reconciling finds unsaved songs wherever they were")
+    reconcile_parser.add_argument("--tracks", default=500, type=int, help="Library size")
+
+    args = parser.parse_args()
+    if args.benchmark not in BENCHMARKS:
+        parser.print_help()
+        return 0
+    return BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
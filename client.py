@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import socket
+import sys
+
+SOCKET_NAME = "rg.sock"
+
+def socket_path(config_dir):
+    return os.path.join(config_dir, SOCKET_NAME)
+
+# Sends a request to the daemon and yields each message it replies with, or
+# returns None straight away if no daemon is listening
+def request(config_dir, message):
+    path = socket_path(config_dir)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+    return messages(sock)
+
+def messages(sock):
+    with sock, sock.makefile("r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+# Runs the rg.py command |argv| in the daemon for |config_dir|, copying its
+# output to ours. Returns the exit status, or None if there's no daemon.
+def forward(config_dir, argv):
+    replies = request(config_dir, {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "columns": shutil.get_terminal_size().columns
+    })
+    if replies is None:
+        return None
+    status = 1
+    for reply in replies:
+        if "out" in reply:
+            sys.stdout.write(reply["out"])
+        elif "err" in reply:
+            sys.stderr.write(reply["err"])
+        elif "status" in reply:
+            status = reply["status"]
+    sys.stdout.flush()
+    return status
@@ -0,0 +1,123 @@
+import json
+import os
+import socketserver
+import sys
+import threading
+import traceback
+import client
+import rg
+from threadstream import ThreadLocalStream
+
+# Arguments holding file names, which are relative to the client's directory
+PATH_ARGUMENTS = [ "out", "file", "library", "import_json", "ids" ]
+
+class ReplyStream:
+    def __init__(self, wfile, key):
+        self.wfile = wfile
+        self.key = key
+
+    def write(self, s):
+        if s:
+            self.wfile.write((json.dumps({ self.key: s }) + "\n").encode("utf-8"))
+        return len(s)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def isatty(self):
+        return False
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        if message.get("ping"):
+            self.reply({ "status": 0 })
+            return
+        if message.get("stop"):
+            self.reply({ "status": 0 })
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        out = ReplyStream(self.wfile, "out")
+        err = ReplyStream(self.wfile, "err")
+        sys.stdout.redirect(out)
+        sys.stderr.redirect(err)
+        try:
+            status = self.run(message)
+        finally:
+            sys.stdout.redirect(None)
+            sys.stderr.redirect(None)
+        self.reply({ "status": status })
+
+    def run(self, message):
+        try:
+            args = rg.parser.parse_args(message["argv"])
+        except SystemExit as e:
+            return e.code or 0
+        if args.command not in rg.FORWARDED_COMMANDS:
+            print("%s can't be run by the daemon" % args.command, file=sys.stderr)
+            return 1
+        for name in PATH_ARGUMENTS:
+            value = getattr(args, name, None)
+            if value is not None:
+                setattr(args, name, os.path.join(message.get("cwd", ""), value))
+        ctx = self.server.ctx.share(args.verbose, message.get("columns"))
+        try:
+            return rg.COMMANDS[args.command](ctx, args) or 0
+        except SystemExit as e:
+            return e.code or 0
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+    def reply(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# Serves rg.py commands for |ctx|'s config directory until stopped. The API
+# session, tokens, saved-status cache and player stay warm between requests.
+def serve(ctx):
+    from player import CachingPlayer
+    path = client.socket_path(ctx.config_dir)
+    if os.path.exists(path):
+        replies = client.request(ctx.config_dir, { "ping": True })
+        if replies is not None:
+            list(replies)
+            print("A daemon is already running on %s" % path)
+            return
+        os.remove(path)
+
+    # Build everything up front so that the first request is fast too
+    ctx.components["spotify"] = CachingPlayer(ctx.spotify())
+    ctx.api()
+    ctx.saved_cache()
+    if os.path.exists(ctx.library_file()):
+        ctx.saved_cache().seed(ctx.library_store())
+
+    sys.stdout = ThreadLocalStream(sys.stdout)
+    sys.stderr = ThreadLocalStream(sys.stderr)
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.ctx = ctx
+    print("Listening on %s" % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        if "save_queue" in ctx.components:
+            ctx.save_queue().flush()
+
+def stop(config_dir):
+    replies = client.request(config_dir, { "stop": True })
+    if replies is None:
+        print("No daemon is running")
+    else:
+        list(replies)
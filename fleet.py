@@ -0,0 +1,143 @@
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from threadstream import ThreadLocalStream
+
+DEFAULT_WORKERS = 8
+
+# The account directories under |directory|: those holding a usertoken.txt, i.e.
+# that have been authorised with `rg.py -c DIR serve`
+def find_accounts(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if os.path.isfile(os.path.join(directory, name, "usertoken.txt")))
+
+# Passes requests on to the Transport shared by every account (and so its
+# connection pool and rate limiter), counting them for the account's report
+class CountingTransport:
+    def __init__(self, http):
+        self.http = http
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def request(self, method, uri, **kwargs):
+        with self.lock:
+            self.requests += 1
+        return self.http.request(method, uri, **kwargs)
+
+    def get(self, uri, **kwargs):
+        return self.request("GET", uri, **kwargs)
+
+    def put(self, uri, **kwargs):
+        return self.request("PUT", uri, **kwargs)
+
+    def post(self, uri, **kwargs):
+        return self.request("POST", uri, **kwargs)
+
+    def delete(self, uri, **kwargs):
+        return self.request("DELETE", uri, **kwargs)
+
+class AccountReport:
+    def __init__(self, name):
+        self.name = name
+        self.status = "pending"
+        self.steps = 0
+        self.seconds = 0.0
+        self.error = None
+        self.http = None
+        self.output = io.StringIO()
+
+    def requests(self):
+        return self.http.requests if self.http is not None else 0
+
+    def line(self):
+        rate = self.requests() / self.seconds if self.seconds else 0
+        return "%-24s %-9s %5d %8d %8.1f %8.1f  %s" % (self.name, self.status, self.steps, self.requests(),
+                                                       self.seconds, rate, self.error or "")
+
+# Runs |steps|, a list of (name, function taking an account's Context), for
+# every account on |workers| threads. Each account's steps run in order, and
+# each step is queued behind every other account's next step when the previous
+# one finishes, so accounts take turns however long their steps are. Once
+# |deadline| seconds have passed no more steps are started. |make_context|
+# builds an account's Context given its name and its CountingTransport over
+# the shared |http|.
+class Fleet:
+    def __init__(self, accounts, make_context, steps, http, workers=DEFAULT_WORKERS, deadline=None, log=False):
+        self.accounts = accounts
+        self.make_context = make_context
+        self.steps = steps
+        self.http = http
+        self.workers = workers
+        self.deadline = deadline
+        self.log = log
+        self.lock = threading.Lock()
+        self.remaining = len(accounts)
+        self.done = threading.Event()
+
+    def run(self):
+        self.started = monotonic()
+        reports = [ AccountReport(name) for name in self.accounts ]
+        if not reports:
+            return reports
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = ThreadLocalStream(stdout), ThreadLocalStream(stderr)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as self.pool:
+                for report in reports:
+                    self.pool.submit(self.run_step, report, None, 0)
+                self.done.wait()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        return reports
+
+    def run_step(self, report, ctx, index):
+        if self.deadline is not None and monotonic() - self.started > self.deadline:
+            report.status = "timed out"
+            self.finish(report)
+            return
+        sys.stdout.redirect(report.output)
+        sys.stderr.redirect(report.output)
+        start = monotonic()
+        try:
+            if ctx is None:
+                report.http = CountingTransport(self.http)
+                ctx = self.make_context(report.name, report.http)
+            name, step = self.steps[index]
+            report.status = name
+            step(ctx)
+            report.steps += 1
+        except Exception as e:
+            report.status = "failed"
+            report.error = "%s: %s" % (type(e).__name__, e)
+        finally:
+            report.seconds += monotonic() - start
+            sys.stdout.redirect(None)
+            sys.stderr.redirect(None)
+
+        if report.status == "failed":
+            self.finish(report)
+        elif index + 1 < len(self.steps):
+            self.pool.submit(self.run_step, report, ctx, index + 1)
+        else:
+            report.status = "ok"
+            self.finish(report)
+
+    def finish(self, report):
+        if self.log:
+            print("%s: %s" % (report.name, report.status))
+            sys.stdout.write(report.output.getvalue())
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+def print_reports(reports, elapsed):
+    print("%-24s %-9s %5s %8s %8s %8s  %s" % ("account", "status", "steps", "requests", "seconds", "req/s", "error"))
+    for report in reports:
+        print(report.line())
+    failed = sum(1 for r in reports if r.status != "ok")
+    print("%d accounts, %d requests in %.1fs, %d not completed" %
+          (len(reports), sum(r.requests() for r in reports), elapsed, failed))
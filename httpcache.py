@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import urllib.parse
+import zlib
+import requests
+import stats
+from time import time
+
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+# Keys looked up per query, within SQLite's limit on parameters
+LOOKUP_BATCH = 500
+
+# Seconds that responses under each path (relative to the API root) are served
+# without asking the API, matched on the longest prefix. A TTL of 0 still keeps
+# the response so that it can be revalidated with its ETag and answered with a
+# 304. Paths not listed aren't cached.
+TTLS = {
+        "/me": 24 * 60 * 60,
+        "/me/tracks": 0,
+        "/me/tracks/contains": 5 * 60,
+        "/playlists": 0,
+        }
+
+# Track metadata hardly ever changes. resolver.py keeps it per track, under
+# /tracks/{id}, as batches of IDs from /tracks?ids= would rarely repeat.
+TRACK_TTL = 7 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+"""
+
+# Builds the response for a cache hit, so that callers can't tell it apart
+# from one that came from the API
+def cached_response(uri, body):
+    r = requests.Response()
+    r.status_code = 200
+    r.url = uri
+    r._content = body
+    r.headers["Content-Type"] = "application/json"
+    return r
+
+# An on-disk cache of GET responses from the API, shared by every run that uses
+# the same config directory (and so the same account). Entries are kept until
+# their TTL runs out and are then revalidated with If-None-Match; once the
+# bodies add up to more than |max_size| bytes (compressed) the least recently
+# used ones are dropped.
+class HttpCache:
+    def __init__(self, path, api_root, max_size=DEFAULT_MAX_SIZE, ttls=TTLS):
+        self.api_root = api_root
+        self.max_size = max_size
+        self.ttls = ttls
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, path):
+        matches = [ p for p in self.ttls if path == p or path.startswith(p + "/") ]
+        return self.ttls[max(matches, key=len)] if matches else None
+
+    # The path relative to the API root and the query string with |params|
+    # merged in and sorted, so that a 'next' link and the same request built
+    # from params share an entry
+    def key(self, uri, params):
+        parts = urllib.parse.urlsplit(uri)
+        query = urllib.parse.parse_qsl(parts.query) + list((params or {}).items())
+        path = parts.path[len(urllib.parse.urlsplit(self.api_root).path):]
+        return path, path + "?" + urllib.parse.urlencode(sorted((k, str(v)) for k, v in query))
+
+    # Answers a GET of |uri| from the cache if it can, and otherwise calls
+    # |send| with any headers to add to the request
+    def get(self, uri, params, send):
+        path, key = self.key(uri, params)
+        ttl = self.ttl(path)
+        if ttl is None:
+            return send({})
+        now = time()
+        with self.lock:
+            entry = self.db.execute("SELECT etag, body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if entry is not None and entry[2] > now:
+                with self.db:
+                    self.db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+                stats.count("http cache hits")
+                return cached_response(uri, zlib.decompress(entry[1]))
+
+        r = send({ "If-None-Match": entry[0] } if entry is not None and entry[0] else {})
+        if r.status_code == 304 and entry is not None:
+            with self.lock, self.db:
+                self.db.execute("UPDATE responses SET expires_at = ?, used_at = ? WHERE key = ?", (now + ttl, now, key))
+            stats.count("http cache revalidated")
+            return cached_response(uri, zlib.decompress(entry[1]))
+        stats.count("http cache misses")
+        if r.status_code == 200 and (ttl > 0 or r.headers.get("ETag")):
+            self.store(key, r.headers.get("ETag"), r.content, now + ttl)
+        return r
+
+    # The bodies stored under any of |keys| that haven't expired, by key
+    def lookup_many(self, keys):
+        now = time()
+        found = {}
+        with self.lock, self.db:
+            for i in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[i:i + LOOKUP_BATCH]
+                rows = self.db.execute("SELECT key, body FROM responses WHERE expires_at > ? AND key IN (%s)" % ", ".join("?" * len(batch)),
+                                       [ now ] + batch).fetchall()
+                self.db.executemany("UPDATE responses SET used_at = ? WHERE key = ?", ((now, key) for key, _ in rows))
+                found.update((key, zlib.decompress(body)) for key, body in rows)
+        return found
+
+    def store(self, key, etag, content, expires_at):
+        self.store_many([ (key, etag, content, expires_at) ])
+
+    # |entries| are (key, ETag, content, expiry time), stored in one transaction
+    def store_many(self, entries):
+        rows = [ (key, etag, zlib.compress(content), expires_at) for key, etag, content, expires_at in entries ]
+        now = time()
+        with self.lock, self.db:
+            for key, etag, body, expires_at in rows:
+                old = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.size -= old[0] if old is not None else 0
+                self.db.execute("INSERT OR REPLACE INTO responses (key, etag, body, size, expires_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                (key, etag, body, len(body), expires_at, now))
+                self.size += len(body)
+            while self.size > self.max_size:
+                oldest = self.db.execute("SELECT key, size FROM responses ORDER BY used_at LIMIT 1").fetchone()
+                self.db.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                self.size -= oldest[1]
+
+    # Drops everything under |path| (relative to the API root), e.g. after a
+    # change made through the API
+    def invalidate(self, path):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses WHERE substr(key, 1, ?) IN (?, ?)", (len(path) + 1, path + "?", path + "/"))
+            self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    # Drops what a PUT, POST or DELETE of |uri| may have changed: everything
+    # under its first two path segments, e.g. /me/tracks or /playlists/{id}
+    def changed(self, uri):
+        path, _ = self.key(uri, None)
+        self.invalidate("/".join(path.split("/")[:3]))
+
+    def close(self):
+        self.db.close()
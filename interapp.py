@@ -1,14 +1,26 @@
+import threading
 from Foundation import NSAppleScript
 from AppKit import NSBundle
+from player import Player
 
 # Ensures that an app icon doesn't show in the Dock
 info = NSBundle.mainBundle().infoDictionary()
 info["LSBackgroundOnly"] = "1"
 
+# Compiling is the expensive part of running an AppleScript, so each script is
+# only compiled once. NSAppleScript isn't thread safe, hence the lock.
+compiled_scripts = {}
+script_lock = threading.Lock()
+
 def apple_script(script):
     try:
-        s = NSAppleScript.alloc().initWithSource_(script)
-        res, err = s.executeAndReturnError_(None)
+        with script_lock:
+            s = compiled_scripts.get(script)
+            if s is None:
+                s = NSAppleScript.alloc().initWithSource_(script)
+                s.compileAndReturnError_(None)
+                compiled_scripts[script] = s
+            res, err = s.executeAndReturnError_(None)
         return res.stringValue()
     except:
         return None
@@ -25,26 +37,71 @@ def play_next():
 def play_previous():
     spotify_command("previous track")
 
-def get_property(prop):
-    return spotify_command("get the %s of the current track" % prop)
+# AppleScript can't return the whole 'current track' object, but one script can
+# return every property that we need joined by a separator, which saves five
+# round trips to Spotify compared to asking for each property in turn
+SEPARATOR = "\x1f"
+
+SNAPSHOT_SCRIPT = """
+if application "Spotify" is not running then return ""
+tell application "Spotify"
+    if player state is stopped then return ""
+    set sep to ASCII character 31
+    set t to current track
+    return (id of t) & sep & (name of t) & sep & (artist of t) & sep & (album of t) & sep & ((duration of t) as string) & sep & ((player position) as string)
+end tell
+"""
+
+def parse_snapshot(s):
+    if not s:
+        return None
+    fields = s.split(SEPARATOR)
+    if len(fields) != 6:
+        return None
+    uri, name, artist, album, duration, position = fields
+    return {
+            "id": uri.split(":")[2],
+            "uri": uri,
+            "name": name,
+            "artist": artist,
+            "album": album,
+            "duration": float(duration.replace(",", ".")) / 1000.0, # ms to s
+            "position": float(position.replace(",", "."))
+            }
+
+PROBE_SCRIPT = """
+if application "Spotify" is not running then return ""
+tell application "Spotify"
+    set state to (player state) as string
+    if state is "stopped" then return state
+    return state & (ASCII character 31) & (id of current track) & (ASCII character 31) & ((player position) as string)
+end tell
+"""
+
+def parse_probe(s):
+    if not s:
+        return None
+    fields = s.split(SEPARATOR)
+    if len(fields) != 3:
+        return (fields[0], None, None)
+    state, uri, position = fields
+    return (state, uri.split(":")[2], float(position.replace(",", ".")))
 
-# I've done some experimentation with trying to get the whole of the 'current
-# track' object from Spotify, but it seems that this isn't something that is
-# actually supported by AppleScript (the language) so I've had to stick to doing
-# it this way instead :(
 def get_current():
-    # Intentionally not all of the properties to ensure this is fast
-    properties = [ "id", "name", "artist", "album", "duration" ]
-    res = {}
-    for prop in properties:
-        res[prop] = get_property(prop)
-        if res[prop] == None:
-            return None
-    res["uri"] = res["id"]
-    res["id"] = res["uri"].split(":")[2]
-    res["duration"] = float(res["duration"]) / 1000.0 # ms to s
-    res["position"] = get_position()
-    return res
-
-def get_position():
-    return float(spotify_command("get the player position"))
+    return parse_snapshot(apple_script(SNAPSHOT_SCRIPT))
+
+class AppleScriptPlayer(Player):
+    def snapshot(self):
+        return get_current()
+
+    def probe(self):
+        return parse_probe(apple_script(PROBE_SCRIPT))
+
+    def toggle_play_pause(self):
+        toggle_play_pause()
+
+    def play_next(self):
+        play_next()
+
+    def play_previous(self):
+        play_previous()
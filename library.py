@@ -0,0 +1,273 @@
+import datetime
+import gzip
+import json
+import stats
+import sys
+import sqlite3
+import threading
+from track import Track
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    added_at TEXT NOT NULL,
+    album_id TEXT,
+    data TEXT NOT NULL
+);
+"""
+
+# Version 2 adds the columns used by queries (see query.py)
+MIGRATE_TO_2 = """
+ALTER TABLE tracks ADD COLUMN artist_id TEXT;
+ALTER TABLE tracks ADD COLUMN name TEXT;
+ALTER TABLE tracks ADD COLUMN artist TEXT;
+ALTER TABLE tracks ADD COLUMN album TEXT;
+ALTER TABLE tracks ADD COLUMN duration_ms INTEGER;
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS tracks_added_at ON tracks (added_at);
+CREATE INDEX IF NOT EXISTS tracks_album_id ON tracks (album_id);
+CREATE INDEX IF NOT EXISTS tracks_artist_id ON tracks (artist_id, name);
+"""
+
+# Where `rg.py cache` collects a fresh copy of the library before swapping it
+# in, so that an interrupted run can resume without disturbing 'tracks'
+STAGING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS staged_tracks (
+    id TEXT PRIMARY KEY,
+    added_at TEXT NOT NULL,
+    album_id TEXT,
+    artist_id TEXT,
+    name TEXT,
+    artist TEXT,
+    album TEXT,
+    duration_ms INTEGER,
+    data TEXT NOT NULL
+);
+"""
+
+# Tracks are imported and exported in batches of this many to bound memory use
+BATCH_SIZE = 1000
+# IDs looked up per query, within SQLite's limit on parameters
+LOOKUP_BATCH = 500
+
+COLUMNS = "id, added_at, album_id, artist_id, name, artist, album, duration_ms, data"
+
+TRACK_COLUMNS = "id, name, artist, album, duration_ms, added_at, album_id, artist_id"
+
+def row(track):
+    return (track.id, track.added_at, track.album_id, track.artist_id, track.name, track.artist,
+            track.album, int(round(track.duration * 1000)), track.raw_json)
+
+# Saved tracks keyed by track ID. Each row keeps the saved-track object from
+# the API as JSON alongside the columns that we index and query on. 'added_at'
+# is an ISO 8601 string so sorts chronologically as text. Tracks saved at the
+# same time are listed in the order they were stored, which is the API's.
+class LibraryStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        # Commits then survive the process being killed without waiting for
+        # the disk, which `rg.py cache` makes one of per page
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            self.migrate()
+            self.db.executescript(INDEXES)
+
+    def migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 2:
+            self.db.executescript(MIGRATE_TO_2)
+            rows = [ row(Track.from_saved_track(json.loads(data), keep_raw=True)) for (data,) in self.db.execute("SELECT data FROM tracks") ]
+            self.db.executemany("INSERT OR REPLACE INTO tracks (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % COLUMNS, rows)
+        self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def newest_added_at(self):
+        with self.lock:
+            newest = self.db.execute("SELECT MAX(added_at) FROM tracks").fetchone()[0]
+        if newest is None:
+            return None
+        return datetime.datetime.strptime(newest, "%Y-%m-%dT%H:%M:%SZ")
+
+    # |tracks| are Tracks holding their raw JSON
+    def upsert(self, tracks):
+        rows = [ row(t) for t in tracks ]
+        with stats.phase("library upsert"), self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO tracks (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % COLUMNS, rows)
+
+    def delete(self, ids):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM tracks WHERE id = ?", ((i,) for i in ids))
+
+    def clear_staged(self):
+        with self.lock, self.db:
+            self.db.execute("DROP TABLE IF EXISTS staged_tracks")
+
+    def stage(self, tracks):
+        rows = [ row(t) for t in tracks ]
+        with stats.phase("library stage"), self.lock, self.db:
+            self.db.executescript(STAGING_SCHEMA)
+            self.db.executemany("INSERT OR REPLACE INTO staged_tracks (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % COLUMNS, rows)
+
+    def count_staged(self):
+        with self.lock:
+            if self.db.execute("SELECT name FROM sqlite_master WHERE name = 'staged_tracks'").fetchone() is None:
+                return 0
+            return self.db.execute("SELECT COUNT(*) FROM staged_tracks").fetchone()[0]
+
+    # Replaces the library with the staged tracks in a single transaction
+    def commit_staged(self):
+        with stats.phase("library commit"), self.lock, self.db:
+            self.db.executescript(STAGING_SCHEMA)
+            self.db.execute("DELETE FROM tracks")
+            self.db.execute("INSERT INTO tracks (%s) SELECT %s FROM staged_tracks ORDER BY rowid" % (COLUMNS, COLUMNS))
+            self.db.execute("DROP TABLE staged_tracks")
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    # Builds Tracks from rows of TRACK_COLUMNS; their raw JSON is only read
+    # from the store if it is asked for
+    def make_tracks(self, rows):
+        return [ Track(track_id, "spotify:track:" + track_id, name, artist, album, duration_ms / 1000.0,
+                       added_at, album_id, artist_id, load_raw=self.raw_json)
+                 for track_id, name, artist, album, duration_ms, added_at, album_id, artist_id in rows ]
+
+    def raw_json(self, track_id):
+        with self.lock:
+            return self.db.execute("SELECT data FROM tracks WHERE id = ?", (track_id,)).fetchone()[0]
+
+    # The stored Tracks with any of |ids|, keyed by ID
+    def tracks_by_id(self, ids):
+        found = {}
+        for batch in batches(ids, LOOKUP_BATCH):
+            sql = "SELECT %s FROM tracks WHERE id IN (%s)" % (TRACK_COLUMNS, ", ".join("?" * len(batch)))
+            found.update((t.id, t) for t in self.make_tracks(self.execute(sql, batch)))
+        return found
+
+    def track_ids(self):
+        with self.lock:
+            return [ r[0] for r in self.db.execute("SELECT id FROM tracks ORDER BY added_at DESC, rowid") ]
+
+    # Newest first, as returned by the API
+    def tracks(self):
+        return self.make_tracks(self.execute("SELECT %s FROM tracks ORDER BY added_at DESC, rowid" % TRACK_COLUMNS))
+
+    # Accepts any of the formats written by LibraryWriter
+    def import_json(self, library_file):
+        with stats.phase("library import"):
+            for batch in batches(read_library_file(library_file)):
+                self.upsert([ Track.from_saved_track(s, keep_raw=True) for s in batch ])
+
+    # Writes the library one track at a time, in the format given by the
+    # extension of |library_file| (see file_format)
+    def export_json(self, library_file):
+        with stats.phase("library export"), self.lock:
+            rows = self.db.execute("SELECT data FROM tracks ORDER BY added_at DESC, rowid")
+            writer = LibraryWriter(library_file)
+            for batch in batches(rows):
+                writer.write(json.loads(data) for (data,) in batch)
+            writer.close()
+
+def batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Returns (JSON Lines, gzipped) for a library file name: 'library.json' is a
+# single JSON array as always, 'library.jsonl' has one saved track per line and
+# either may end in '.gz'
+def file_format(path):
+    gzipped = path.endswith(".gz")
+    if gzipped:
+        path = path[:-3]
+    return path.endswith(".jsonl"), gzipped
+
+def is_library_file(path):
+    return path.endswith((".json", ".jsonl", ".json.gz", ".jsonl.gz"))
+
+def read_library_file(path):
+    lines, gzipped = file_format(path)
+    with (gzip.open if gzipped else open)(path, "rt") as f:
+        if not lines:
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# Writes saved tracks to a library file as they arrive. write() returns the
+# size of the file after flushing, and each write is a separate gzip member
+# when compressing, so a caller can checkpoint that size and a later writer
+# opened with it (and the number of tracks written so far) truncates away
+# anything written since and carries on. A |path| of None writes to stdout.
+# The library.json format is the same as json.dump(..., indent=4,
+# sort_keys=True) gives for the whole list.
+class LibraryWriter:
+    def __init__(self, path, size=None, count=0):
+        self.path = path
+        self.count = count
+        if path is None:
+            self.lines, self.gzipped = False, False
+            self.f = sys.stdout
+        else:
+            self.lines, self.gzipped = file_format(path)
+            if size is None:
+                self.f = open(path, "wb")
+            else:
+                self.f = open(path, "r+b")
+                self.f.truncate(size)
+                self.f.seek(size)
+
+    def encode(self, saved_tracks):
+        parts = []
+        for saved_track in saved_tracks:
+            if self.lines:
+                parts.append(json.dumps(saved_track, sort_keys=True) + "\n")
+            else:
+                parts.append("[\n    " if self.count == 0 else ",\n    ")
+                parts.append(json.dumps(saved_track, indent=4, sort_keys=True).replace("\n", "\n    "))
+            self.count += 1
+        return "".join(parts)
+
+    def write_text(self, text):
+        if self.path is None:
+            self.f.write(text)
+            self.f.flush()
+            return None
+        with stats.phase("library write") as record:
+            data = text.encode("utf-8")
+            if self.gzipped and data:
+                data = gzip.compress(data)
+            self.f.write(data)
+            self.f.flush()
+            record.add_bytes(len(data))
+        return self.f.tell()
+
+    def write(self, saved_tracks):
+        return self.write_text(self.encode(saved_tracks))
+
+    def close(self):
+        if not self.lines:
+            self.write_text(("[]" if self.count == 0 else "\n]") + ("\n" if self.path is None else ""))
+        if self.path is not None:
+            self.f.close()
@@ -0,0 +1,149 @@
+import threading
+from time import monotonic, sleep
+
+# A desktop player that Ravenglass can control. snapshot() returns the current
+# track as a dictionary with 'id', 'uri', 'name', 'artist', 'album', 'duration'
+# and 'position' (both in seconds), or None if nothing is playing, in a single
+# round trip to the player. probe() is a cheaper call for polling that returns
+# a (state, track ID, position) tuple, where state is 'playing', 'paused' or
+# 'stopped', or None if the player isn't running.
+class Player:
+    def snapshot(self):
+        raise NotImplementedError
+
+    def probe(self):
+        s = self.snapshot()
+        if s is None:
+            return None
+        return ("playing", s["id"], s["position"])
+
+    def toggle_play_pause(self):
+        raise NotImplementedError
+
+    def play_next(self):
+        raise NotImplementedError
+
+    def play_previous(self):
+        raise NotImplementedError
+
+def simulated_tracks(count=20):
+    return [ {
+                "id": "sim%018d" % i,
+                "uri": "spotify:track:sim%018d" % i,
+                "name": "Simulated Song %d" % i,
+                "artist": "Simulated Artist %d" % (i % 5),
+                "album": "Simulated Album %d" % (i // 3),
+                "duration": 150.0 + (i * 37) % 120
+             } for i in range(count) ]
+
+# An in-process player that plays through |tracks| in real time (scaled by
+# |speed|). Every call sleeps for |latency| seconds to stand in for the round
+# trip to a real player, and |calls| counts them, so that rg.py can be run and
+# benchmarked without Spotify or macOS.
+class SimulatedPlayer(Player):
+    def __init__(self, tracks=None, latency=0.0, speed=1.0):
+        self.tracks = tracks if tracks is not None else simulated_tracks()
+        self.latency = latency
+        self.speed = speed
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.index = 0
+        self.playing = True
+        self.offset = 0.0
+        self.started = monotonic()
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            sleep(self.latency)
+
+    # Advances through the track list according to the time elapsed
+    def _position(self):
+        position = self.offset
+        if self.playing:
+            position += (monotonic() - self.started) * self.speed
+        while self.tracks and position >= self.tracks[self.index]["duration"]:
+            position -= self.tracks[self.index]["duration"]
+            self.index = (self.index + 1) % len(self.tracks)
+            self.offset = position
+            self.started = monotonic()
+            position = self.offset
+        return position
+
+    def snapshot(self):
+        self._call()
+        with self.lock:
+            if not self.tracks:
+                return None
+            position = self._position()
+            res = dict(self.tracks[self.index])
+            res["position"] = position
+            return res
+
+    def probe(self):
+        self._call()
+        with self.lock:
+            if not self.tracks:
+                return ("stopped", None, None)
+            position = self._position()
+            return ("playing" if self.playing else "paused", self.tracks[self.index]["id"], position)
+
+    def toggle_play_pause(self):
+        self._call()
+        with self.lock:
+            self.offset = self._position()
+            self.started = monotonic()
+            self.playing = not self.playing
+
+    def _skip(self, delta):
+        self._call()
+        with self.lock:
+            if self.tracks:
+                self.index = (self.index + delta) % len(self.tracks)
+            self.offset = 0.0
+            self.started = monotonic()
+
+    def play_next(self):
+        self._skip(1)
+
+    def play_previous(self):
+        self._skip(-1)
+
+# Remembers the metadata of the current track so that, while it keeps playing,
+# snapshot() only needs the cheaper probe() for the position
+class CachingPlayer(Player):
+    def __init__(self, player):
+        self.player = player
+        self.track = None
+
+    def snapshot(self):
+        probe = self.player.probe()
+        if probe is None or probe[1] is None:
+            return None
+        track = self.track
+        if track is None or track["id"] != probe[1]:
+            track = self.player.snapshot()
+            if track is None:
+                return None
+            self.track = track
+        res = dict(track)
+        res["position"] = probe[2]
+        return res
+
+    def probe(self):
+        return self.player.probe()
+
+    def toggle_play_pause(self):
+        self.player.toggle_play_pause()
+
+    def play_next(self):
+        self.player.play_next()
+
+    def play_previous(self):
+        self.player.play_previous()
+
+def get_player(backend="applescript"):
+    if backend == "simulated":
+        return SimulatedPlayer()
+    import interapp
+    return interapp.AppleScriptPlayer()
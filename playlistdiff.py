@@ -0,0 +1,73 @@
+from bisect import bisect_left
+
+# Works out the edits that turn the playlist |current| into |target| (both
+# lists of track URIs) in as few requests as possible:
+#
+# * removals: (uri, position) pairs for tracks in |current| that aren't wanted
+# * moves: (range_start, insert_before) reorders, applied in order after the
+#   removals; only tracks outside the longest run that is already in target
+#   order are moved
+# * additions: (position, uris) inserts, applied in order after the moves
+#
+# A URI that appears several times is matched occurrence by occurrence.
+def playlist_diff(current, target):
+    current_keys = occurrence_keys(current)
+    target_keys = occurrence_keys(target)
+    target_index = { key: i for i, key in enumerate(target_keys) }
+
+    removals = [ (key[0], i) for i, key in enumerate(current_keys) if key not in target_index ]
+    kept = [ key for key in current_keys if key in target_index ]
+
+    in_order = set(longest_increasing_subsequence(kept, lambda key: target_index[key]))
+    working = list(kept)
+    placed = sorted(target_index[key] for key in in_order)
+    moves = []
+    for key in sorted((key for key in kept if key not in in_order), key=lambda key: target_index[key]):
+        i = working.index(key)
+        del working[i]
+        # Insert directly after the nearest placed track that precedes it
+        n = bisect_left(placed, target_index[key])
+        p = working.index(target_keys[placed[n - 1]]) + 1 if n > 0 else 0
+        working.insert(p, key)
+        placed.insert(n, target_index[key])
+        moves.append((i, p if p <= i else p + 1))
+
+    present = set(kept)
+    additions = []
+    for i, key in enumerate(target_keys):
+        if key in present:
+            continue
+        if additions and additions[-1][0] + len(additions[-1][1]) == i:
+            additions[-1][1].append(key[0])
+        else:
+            additions.append((i, [ key[0] ]))
+    return removals, moves, additions
+
+def occurrence_keys(uris):
+    seen = {}
+    keys = []
+    for uri in uris:
+        seen[uri] = seen.get(uri, -1) + 1
+        keys.append((uri, seen[uri]))
+    return keys
+
+def longest_increasing_subsequence(items, key):
+    tails = []
+    tail_items = []
+    previous = {}
+    for item in items:
+        k = key(item)
+        n = bisect_left(tails, k)
+        previous[item] = tail_items[n - 1] if n > 0 else None
+        if n == len(tails):
+            tails.append(k)
+            tail_items.append(item)
+        else:
+            tails[n] = k
+            tail_items[n] = item
+    result = []
+    item = tail_items[-1] if tail_items else None
+    while item is not None:
+        result.append(item)
+        item = previous[item]
+    return result[::-1]
@@ -0,0 +1,126 @@
+import datetime
+from library import TRACK_COLUMNS
+
+# Columns that queries may filter, group and sort on
+COLUMNS = [ "id", "added_at", "album_id", "artist_id", "name", "artist", "album", "duration_ms" ]
+AGGREGATES = { "count": "COUNT(*) AS count", "newest": "MAX(added_at) AS newest", "oldest": "MIN(added_at) AS oldest" }
+COMPARISONS = ( "=", "!=", "<", "<=", ">", ">=" )
+
+def check_column(column):
+    if column not in COLUMNS and column not in AGGREGATES:
+        raise ValueError("Unknown column %s" % column)
+    return column
+
+def check_operator(op, allowed=COMPARISONS):
+    if op not in allowed:
+        raise ValueError("Unknown operator %s" % op)
+    return op
+
+def timestamp(date):
+    if isinstance(date, datetime.datetime):
+        return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return date.strftime("%Y-%m-%dT00:00:00Z")
+
+# A query over the tracks in a LibraryStore, built up by chaining:
+#
+#   Query(store).group_by("artist_id", "artist").order_by("count", True).limit(10).groups()
+#
+# Filters and sorts run against the store's indexed columns in SQLite; nothing
+# is decoded from the stored JSON. tracks() returns Tracks and groups() returns
+# dictionaries of the grouped columns along with 'count', 'newest' and
+# 'oldest'.
+class Query:
+    def __init__(self, store):
+        self.store = store
+        self.conditions = []
+        self.params = []
+        self.group_columns = []
+        self.having_clauses = []
+        self.having_params = []
+        self.order = []
+        self.max_rows = None
+
+    def where(self, column, op, value):
+        self.conditions.append("%s %s ?" % (check_column(column), check_operator(op, COMPARISONS + ( "LIKE", ))))
+        self.params.append(value)
+        return self
+
+    def added_between(self, start=None, end=None):
+        if start is not None:
+            self.where("added_at", ">=", timestamp(start))
+        if end is not None:
+            self.where("added_at", "<", timestamp(end))
+        return self
+
+    # Restricts to tracks whose (group columns) group satisfies 'count op n'
+    def in_groups(self, columns, op, n):
+        group = ", ".join(check_column(c) for c in columns)
+        self.conditions.append("(%s) IN (SELECT %s FROM tracks GROUP BY %s HAVING COUNT(*) %s ?)" %
+                               (group, group, group, check_operator(op)))
+        self.params.append(n)
+        return self
+
+    def group_by(self, *columns):
+        self.group_columns.extend(check_column(c) for c in columns)
+        return self
+
+    def having_count(self, op, n):
+        self.having_clauses.append("COUNT(*) %s ?" % check_operator(op))
+        self.having_params.append(n)
+        return self
+
+    def order_by(self, column, descending=False):
+        self.order.append("%s%s" % (check_column(column), " DESC" if descending else ""))
+        return self
+
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    def sql(self, select):
+        sql = "SELECT %s FROM tracks" % select
+        params = list(self.params)
+        if self.conditions:
+            sql += " WHERE " + " AND ".join(self.conditions)
+        if self.group_columns:
+            sql += " GROUP BY " + ", ".join(self.group_columns)
+        if self.having_clauses:
+            sql += " HAVING " + " AND ".join(self.having_clauses)
+            params += self.having_params
+        if self.order:
+            sql += " ORDER BY " + ", ".join(self.order)
+        if self.max_rows is not None:
+            sql += " LIMIT ?"
+            params.append(self.max_rows)
+        return sql, params
+
+    def tracks(self):
+        sql, params = self.sql(TRACK_COLUMNS)
+        return self.store.make_tracks(self.store.execute(sql, params))
+
+    def groups(self):
+        columns = self.group_columns + list(AGGREGATES)
+        sql, params = self.sql(", ".join(self.group_columns + list(AGGREGATES.values())))
+        return [ dict(zip(columns, r)) for r in self.store.execute(sql, params) ]
+
+# Tracks from albums with at most |limit| saved tracks, grouped by album with
+# the most recently added album first
+def singles(store, limit):
+    sql = """
+        SELECT t.id, t.name, t.artist, t.album, t.duration_ms, t.added_at, t.album_id, t.artist_id FROM tracks t
+        JOIN (SELECT album_id, MAX(added_at) AS newest FROM tracks
+              GROUP BY album_id HAVING COUNT(*) <= ?) a
+        ON t.album_id IS a.album_id
+        ORDER BY a.newest DESC, t.added_at DESC"""
+    return store.make_tracks(store.execute(sql, (limit,)))
+
+def top_artists(store, n=20):
+    return Query(store).group_by("artist_id", "artist").order_by("count", True).limit(n).groups()
+
+def added_between(store, start=None, end=None):
+    return Query(store).added_between(start, end).order_by("added_at", True).tracks()
+
+# Tracks saved more than once under different IDs, e.g. from a single and its
+# album, matched on artist and name
+def duplicates(store):
+    return Query(store).in_groups([ "artist_id", "name" ], ">", 1).order_by("artist").order_by("name").order_by("added_at", True).tracks()
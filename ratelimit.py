@@ -0,0 +1,76 @@
+import random
+import threading
+from time import sleep, monotonic
+
+# Spotify doesn't publish its limits (they are applied over a rolling 30
+# second window), so start here and let RateLimiter find the real rate, up to
+# DEFAULT_MAX_RATE
+DEFAULT_RATE = 20.0
+DEFAULT_MAX_RATE = 100.0
+DEFAULT_BURST = 10
+MIN_RATE = 0.5
+# Requests per second added for each successful request
+RATE_INCREASE = 0.05
+# Fraction of the rate kept after a 429
+RATE_DECREASE = 0.7
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Paces every request made through a Transport, across all threads.
+#
+# A token bucket holding up to |burst| tokens refills at |rate| per second and
+# each request takes one. Each success adds RATE_INCREASE to the rate, up to
+# |max_rate|, and a 429 pauses everyone until its Retry-After has passed and
+# cuts it to RATE_DECREASE of what it was. So parallel fetches and uploads
+# speed up until the API pushes back and then settle just under the rate it
+# will take. |rate| is only where that starts; a |max_rate| below it makes it
+# a fixed ceiling.
+class RateLimiter:
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_rate=DEFAULT_MAX_RATE):
+        self.max_rate = max_rate
+        self.rate = min(rate, max_rate)
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.paused_until = 0
+
+    # Blocks until the caller may make a request
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+            sleep(delay)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    # Holds back every request for |delay| seconds and slows down afterwards.
+    # Requests already in flight when the first 429 arrived will usually get
+    # one too, so only that first one slows down. The bucket starts empty
+    # after the pause so the requests held back don't all go at once.
+    def throttled(self, delay):
+        with self.lock:
+            now = monotonic()
+            if now >= self.paused_until:
+                self.rate = max(MIN_RATE, self.rate * RATE_DECREASE)
+            self.paused_until = max(self.paused_until, now + delay)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+# Exponential backoff with full jitter, so that threads that failed together
+# don't all retry together
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
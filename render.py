@@ -0,0 +1,55 @@
+import shutil
+import signal
+import sys
+import threading
+import songfmt
+
+# Draws the current song on a single terminal line. The formatted text either
+# side of the position is cached per song, terminal width and saved state, so
+# a tick that only moves the position rewrites just those six columns (and a
+# tick that doesn't change the displayed position writes nothing). The width
+# is only looked up again after the terminal is resized.
+class LineRenderer:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.lock = threading.Lock()
+        self.width = None
+        self.key = None
+        self.prefix = None
+        self.pos = None
+        if hasattr(signal, "SIGWINCH") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGWINCH, self.resized)
+
+    def resized(self, signum=None, frame=None):
+        self.width = None
+
+    def terminal_width(self):
+        if self.width is None:
+            self.width = shutil.get_terminal_size().columns
+            self.key = None
+        return self.width
+
+    def render(self, song, start_time, saved=False):
+        with self.lock:
+            width = self.terminal_width()
+            key = (song['id'], width, start_time, saved)
+            pos = songfmt.position_string(song)
+            if key != self.key or len(pos) != len(self.pos):
+                self.prefix, pos, suffix = songfmt.format_segments(song, width, True, start_time, saved)
+                self.out.write("\r" + self.prefix + pos + suffix)
+                self.key = key
+            elif pos != self.pos:
+                # Return to the start of the line and skip over the prefix
+                self.out.write("\r\x1b[%dC%s" % (len(self.prefix), pos))
+            else:
+                return
+            self.pos = pos
+            self.out.flush()
+
+    # Rewrites the line without the position and moves on to the next one
+    def finish(self, song, start_time, saved=False):
+        with self.lock:
+            width = self.terminal_width()
+            self.out.write("\r" + songfmt.format_song(song, width, True, start_time, saved, include_pos=False) + "\n")
+            self.out.flush()
+            self.key = None
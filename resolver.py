@@ -0,0 +1,85 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from httpcache import TRACK_TTL
+from track import Track
+from webapi import TRACKS_BATCH
+
+DEFAULT_MAX_SIZE = 20000
+
+ID_PATTERN = re.compile(r"^[0-9A-Za-z]{22}$")
+URL_PATTERN = re.compile(r"^https?://open\.spotify\.com/track/([0-9A-Za-z]{22})")
+
+# The track ID in a bare ID, a spotify:track: URI or an open.spotify.com link,
+# or None if |s| is none of those
+def track_id(s):
+    s = s.strip()
+    if s.startswith("spotify:track:"):
+        s = s[len("spotify:track:"):]
+    m = URL_PATTERN.match(s)
+    if m is not None:
+        return m.group(1)
+    return s if ID_PATTERN.match(s) else None
+
+# Turns track IDs into Tracks, looking in turn in memory (the |max_size| most
+# recently resolved), the library |store|, the on-disk HttpCache |cache| and
+# finally /tracks, TRACKS_BATCH IDs a request on up to |jobs| threads. Either
+# of |store| and |cache| may be None.
+class TrackResolver:
+    def __init__(self, api, store=None, cache=None, max_size=DEFAULT_MAX_SIZE, jobs=4):
+        self.api = api
+        self.store = store
+        self.cache = cache
+        self.max_size = max_size
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+
+    def remember(self, tracks):
+        with self.lock:
+            for i, t in tracks:
+                self.memory[i] = t
+                self.memory.move_to_end(i)
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+
+    # Returns a Track (or None if there is no such track) for each of |ids|
+    def resolve(self, ids, log=False):
+        found = {}
+        with self.lock:
+            for i in ids:
+                if i in self.memory:
+                    self.memory.move_to_end(i)
+                    found[i] = self.memory[i]
+        missing = list(OrderedDict.fromkeys(i for i in ids if i not in found))
+
+        if missing and self.store is not None:
+            found.update(self.store.tracks_by_id(missing))
+            missing = [ i for i in missing if i not in found ]
+
+        if missing and self.cache is not None:
+            for key, body in self.cache.lookup_many([ "/tracks/" + i for i in missing ]).items():
+                found[key[len("/tracks/"):]] = Track.from_track(json.loads(body))
+            missing = [ i for i in missing if i not in found ]
+
+        if missing:
+            fetched = self.fetch(missing, log)
+            found.update((i, Track.from_track(track)) for i, track in fetched.items())
+            if self.cache is not None:
+                expires_at = time() + TRACK_TTL
+                self.cache.store_many([ ("/tracks/" + i, None, json.dumps(track).encode("utf-8"), expires_at) for i, track in fetched.items() ])
+
+        self.remember(found.items())
+        return [ found.get(i) for i in ids ]
+
+    # Returns the track object for each of |ids| that exists, by ID
+    def fetch(self, ids, log=False):
+        batches = [ ids[i:i + TRACKS_BATCH] for i in range(0, len(ids), TRACKS_BATCH) ]
+        if log:
+            print("Looking up %d tracks in %d requests" % (len(ids), len(batches)))
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = pool.map(self.api.get_tracks, batches)
+            return { i: t for batch, tracks in zip(batches, results) for i, t in zip(batch, tracks) if t is not None }
@@ -1,21 +1,22 @@
 #!/usr/bin/env python3
 
-REDIRECT_URI = "http://localhost:3000/callback"
-
-import requests, requests.auth, json, sys, shutil, subprocess, time
-import tty, termios
+# Only what every command needs is imported here. Each command imports and
+# constructs the rest (Flask, PyObjC, requests, SQLite, ...) itself, so that
+# e.g. `rg.py --help` or `rg.py cache` don't pay for the others.
 import argparse
-from threading import Thread
-from string import ascii_lowercase
-from random import choice
+import sys
+import threading
 from os.path import expanduser, join
-from time import strftime, gmtime, localtime, sleep
-from math import floor
-import interapp, songfmt, webauth, webapi
+
+BACKENDS = [ "applescript", "simulated" ]
 
 parser = argparse.ArgumentParser(prog="Ravenglass", description="Spotify CLI")
 parser.add_argument("-v", "--verbose", default=False, action="store_true", help="Verbose output")
+parser.add_argument("--player", default="applescript", choices=BACKENDS, help="Desktop player backend")
 parser.add_argument("-c", "--config_dir", default=expanduser("~/.config/ravenglass"), help="Configuration directory")
+parser.add_argument("--no-daemon", default=False, action="store_true", help="Run the command here even if a daemon is running")
+parser.add_argument("--stats", default=False, action="store_true", help="Print request counts, latencies, retries and phase timings to stderr afterwards")
+parser.add_argument("--trace", default=None, metavar="FILE", help="Write a JSON trace of every request and phase (for chrome://tracing or Perfetto)")
 
 subparsers = parser.add_subparsers(help="Commands", dest="command")
 
@@ -24,172 +25,442 @@ what_parser.add_argument("-j", "--json", default=False, action="store_true", hel
 
 serve_parser = subparsers.add_parser('serve', help="Run web server for personal token")
 watch_parser = subparsers.add_parser('watch', help="Interactive mode")
+watch_parser.add_argument("--interval", default=1.0, type=float, help="Seconds between updates while playing")
 
 cache_parser = subparsers.add_parser("cache", help="Cache library as JSON")
-cache_parser.add_argument("--out", default="library.json", help="Destination file")
+cache_parser.add_argument("--out", default="library.json", help="Destination file (.jsonl for JSON Lines, .gz to compress)")
+cache_parser.add_argument("--library", default=None, help="Library store (defaults to library.db in the config directory)")
+cache_parser.add_argument("--from-store", action="store_true", help="Write out the library store as it is rather than fetching the library")
+cache_parser.add_argument("-j", "--jobs", default=1, type=int, help="Number of library pages to fetch in parallel")
 
 playlist_parser = subparsers.add_parser("playlist", help="Create playlist")
 playlist_parser.add_argument("--title", help="Playlist title")
 playlist_parser.add_argument("--file", help="Filename for list of IDs")
+playlist_parser.add_argument("--sync", default=None, metavar="PLAYLIST_ID", help="Update an existing playlist to match instead of creating one")
+playlist_parser.add_argument("-j", "--jobs", default=4, type=int, help="Number of chunks to upload at once")
+playlist_parser.add_argument("--dry", action="store_true", help="Look up and print the songs rather than creating the playlist")
+playlist_parser.add_argument("--validate", action="store_true", help="Look up the songs first and leave out any that don't exist")
 
 singles_parser = subparsers.add_parser("singles", help="Create playlist of single saved songs")
 singles_parser.add_argument("--title", default=None, help="Playlist title (date is appended)")
 singles_parser.add_argument("--limit", default=1, type=int, help="Max saved songs per album")
-singles_parser.add_argument("--library", default="library.json", help="Use a cached library")
+singles_parser.add_argument("--library", default=None, help="Library store (defaults to library.db in the config directory)")
+singles_parser.add_argument("--import-json", default=None, help="Import a library.json cache into the store first")
 singles_parser.add_argument("--dry", action="store_true", help="Prints song IDs and titles rather than creating the playlist")
+singles_parser.add_argument("--sync", default=None, metavar="PLAYLIST_ID", help="Update an existing playlist to match instead of creating one")
+singles_parser.add_argument("-j", "--jobs", default=1, type=int, help="Number of library pages to fetch in parallel")
+singles_parser.add_argument("--reconcile", action="store_true", help="Also drop songs from the store that are no longer saved")
 
 save_parser = subparsers.add_parser("save", help="Save the current song")
+save_parser.add_argument("--ids", default=None, help="Save the song IDs listed in this file instead")
+
+query_parser = subparsers.add_parser("query", help="Query the cached library")
+query_parser.add_argument("query", choices=[ "singles", "top-artists", "added", "duplicates" ], help="Query to run")
+query_parser.add_argument("--limit", default=None, type=int, help="Max saved songs per album (singles) or number of artists (top-artists)")
+query_parser.add_argument("--since", default=None, help="Start date, as YYYY-MM-DD (added)")
+query_parser.add_argument("--until", default=None, help="End date, exclusive, as YYYY-MM-DD (added)")
+query_parser.add_argument("--library", default=None, help="Library store (defaults to library.db in the config directory)")
+query_parser.add_argument("--update", action="store_true", help="Fetch newly saved songs before querying")
+query_parser.add_argument("--reconcile", action="store_true", help="Also drop songs that are no longer saved (implies --update)")
+query_parser.add_argument("--json", action="store_true", help="Output as JSON")
+query_parser.add_argument("--playlist", default=None, metavar="TITLE", help="Create a playlist of the resulting songs")
+query_parser.add_argument("--sync", default=None, metavar="PLAYLIST_ID", help="Update an existing playlist to hold the resulting songs")
+
+fleet_parser = subparsers.add_parser("fleet", help="Update the libraries and singles playlists of many accounts")
+fleet_parser.add_argument("--accounts", default=None, help="Directory of account config directories (defaults to accounts in the config directory)")
+fleet_parser.add_argument("--steps", default="singles", help="Steps to run for each account, in order, from update, reconcile and singles (which updates first)")
+fleet_parser.add_argument("--title", default="Single Songs", help="Singles playlist title (date is appended)")
+fleet_parser.add_argument("--limit", default=1, type=int, help="Max saved songs per album for singles")
+fleet_parser.add_argument("--dry", action="store_true", help="Print the singles rather than creating playlists")
+fleet_parser.add_argument("-w", "--workers", default=8, type=int, help="Number of accounts to work on at once")
+fleet_parser.add_argument("--deadline", default=None, type=float, help="Seconds after which no more steps are started")
+
+daemon_parser = subparsers.add_parser("daemon", help="Keep running and serve other invocations over a Unix socket")
+daemon_parser.add_argument("--stop", action="store_true", help="Stop a running daemon")
+
+
+# Builds the configuration, API client, player and caches on first use.
+# Contexts made with share() reuse the same components, which is how the
+# daemon keeps them warm across requests.
+class Context:
+    def __init__(self, config_dir, player_backend="applescript", verbose=False, columns=None):
+        self.config_dir = config_dir
+        self.player_backend = player_backend
+        self.verbose = verbose
+        self.columns = columns
+        self.lock = threading.RLock()
+        self.components = {}
+
+    def share(self, verbose=False, columns=None):
+        ctx = Context(self.config_dir, self.player_backend, verbose, columns)
+        ctx.lock = self.lock
+        ctx.components = self.components
+        return ctx
+
+    def lazy(self, name, build):
+        with self.lock:
+            if name not in self.components:
+                self.components[name] = build()
+            return self.components[name]
+
+    def config(self):
+        def build():
+            from configparser import ConfigParser
+            config = ConfigParser()
+            config.read(join(self.config_dir, "config.ini"))
+            return config
+        return self.lazy("config", build)
+
+    def http(self):
+        import transport
+        return self.lazy("http", lambda: transport.from_config(self.config()))
+
+    def web_auth(self):
+        import webauth
+        return self.lazy("web_auth", lambda: webauth.WebAuth(self.config(), self.config_dir, self.http()))
+
+    def http_cache(self):
+        def build():
+            import httpcache, transport
+            max_size = self.config().getint("HTTP", "CACHE_SIZE_MB", fallback=httpcache.DEFAULT_MAX_SIZE // 2**20) * 2**20
+            if max_size <= 0:
+                return None
+            return httpcache.HttpCache(join(self.config_dir, "http_cache.db"), transport.API_ROOT, max_size)
+        return self.lazy("http_cache", build)
+
+    def api(self):
+        import webapi
+        return self.lazy("api", lambda: webapi.WebApi(self.web_auth(), self.http(), self.http_cache()))
+
+    def spotify(self):
+        import player
+        return self.lazy("spotify", lambda: player.get_player(self.player_backend))
+
+    def saved_cache(self):
+        import savedcache
+        return self.lazy("saved_cache", lambda: savedcache.SavedStatusCache(self.api()))
 
-args = parser.parse_args()
-
-from configparser import ConfigParser
-
-config = ConfigParser()
-config.read(join(args.config_dir, "config.ini"))
-CLIENT_ID = config['WEB_API']['CLIENT_ID']
-CLIENT_SECRET = config['WEB_API']['CLIENT_SECRET']
-web_auth = webauth.WebAuth(config, args.config_dir)
-api = webapi.WebApi(web_auth)
-
-current_is_saved = False
-
-def fetch_library(auth, log=False, break_early=False):
-    headers = { "Authorization": "Bearer " + auth }
-    params = { "offset": 0, "limit": 50 }
-    import urllib
-    uri = 'https://api.spotify.com/v1/me/tracks?' + urllib.parse.urlencode(params)
-    all_songs = []
-    while uri != None:
-        if log:
-            print("Request %s" % uri)
-        r = requests.get(uri, headers=headers)
-        if r.status_code == 200:
-            j = r.json()
-            all_songs.extend(j['items'])
-            if 'next' in j and j['next'] != None:
-                uri = j['next']
-                params = None
-            else:
-                uri = None
-        elif r.status_code == 401:
-            if log:
-                print("Refreshing token")
-            auth = update_token()
-            headers = { "Authorization": "Bearer " + auth }
-        elif r.status_code == 429:
-            if 'Retry-After' in r.headers:
-                if log:
-                    print("Sleep for " + str(r.headers['Retry-After']))
-                sleep(int(r.headers['Retry-After']))
-        if break_early:
-            break
-    return all_songs
-
-def print_current(current, include_time=True, start_time=localtime(), saved=False, include_newline=False, include_pos=True):
-    width = shutil.get_terminal_size().columns
+    def save_queue(self):
+        import savequeue
+        return self.lazy("save_queue", lambda: savequeue.SaveQueue(self.api(), self.saved_cache(), log=self.verbose))
+
+    def resolver(self):
+        import resolver
+        return self.lazy("resolver", lambda: resolver.TrackResolver(self.api(), self.library_store(), self.http_cache()))
+
+    def library_file(self):
+        return join(self.config_dir, "library.db")
+
+    # |path| was once the library.json that singles read, which now has to be
+    # imported into the store once with --import-json
+    def library_store(self, path=None):
+        import library
+        if path is not None and library.is_library_file(path):
+            print("%s is a library file rather than a store; import it once with --import-json %s" % (path, path), file=sys.stderr)
+            sys.exit(1)
+        path = path if path is not None else self.library_file()
+        try:
+            return library.LibraryStore(path)
+        except library.sqlite3.DatabaseError as e:
+            print("Can't open library store %s: %s" % (path, e), file=sys.stderr)
+            sys.exit(1)
+
+    def playlist_checkpoint(self):
+        return join(self.config_dir, "playlist_checkpoint.json")
+
+    def cache_checkpoint(self):
+        return join(self.config_dir, "cache_checkpoint.json")
+
+def print_current(current, include_time=True, start_time=None, saved=False, include_newline=False, include_pos=True, width=None):
+    import shutil, songfmt
+    from time import localtime
+    width = width if width is not None else shutil.get_terminal_size().columns
+    start_time = start_time if start_time is not None else localtime()
     sys.stdout.write("\r" + songfmt.format_song(current, width, include_time, start_time, saved, include_pos))
     if include_newline:
         sys.stdout.write("\n")
     sys.stdout.flush()
 
-watching = True
-known_saved = set()
+def command_serve(ctx, args):
+    ctx.web_auth().serve()
 
-def configure_terminal_for_single_char_input():
-    fd = sys.stdin.fileno()
-    global old_terminal_settings
-    old_terminal_settings = termios.tcgetattr(fd)
-    try:
-        tty.setraw(sys.stdin.fileno())
-    except:
-        restore_terminal_settings()
-
-def watch():
-    global current
-    global current_is_saved
-    t = localtime()
-    current_is_saved = api.is_saved(current["id"])
-    if current_is_saved:
-        known_saved.add(current["id"])
-    print_current(current, start_time = t, saved=current_is_saved)
-    while watching:
-        new_current = interapp.get_current()
-        if current != None and new_current != None:
-            if current["id"] != new_current["id"]:
-                # Print the previous song after it has finished playing
-                print_current(current, start_time=t, saved=current["id"] in known_saved, include_pos=False)
-                sys.stdout.write("\n")
-                t = localtime()
-                current_is_saved = api.is_saved(new_current["id"])
-                if current_is_saved:
-                    known_saved.add(new_current["id"])
-                else:
-                    known_saved.discard(new_current["id"])
-
-            current = new_current
-            print_current(current, start_time=t, saved= current["id"] in known_saved)
-            sleep(1 - (current['position'] - floor(current['position'])))
-        else:
-            sleep(60) # Wait a minute; Spotify may not be open
+def command_what(ctx, args):
+    current = ctx.spotify().snapshot()
+    if args.json:
+        import json
+        print(json.dumps(current, indent=2, sort_keys=True, separators=(',',': ')))
+    else:
+        print_current(current, include_newline=True, width=ctx.columns)
 
-def restore_terminal_settings():
-    fd = sys.stdin.fileno()
-    termios.tcsetattr(fd, termios.TCSADRAIN, old_terminal_settings)
-    sys.stdout.flush()
+def command_watch(ctx, args):
+    import os, tty, termios
+    from time import localtime
+    from render import LineRenderer
+    from watcher import Watcher
 
-current = interapp.get_current()
+    spotify = ctx.spotify()
+    saved_cache = ctx.saved_cache()
+    save_queue = ctx.save_queue()
+    if os.path.exists(ctx.library_file()):
+        saved_cache.seed(ctx.library_store())
+    renderer = LineRenderer()
+    watcher = Watcher(spotify, args.interval)
+    start_time = [ localtime() ]
 
-if __name__ == "__main__":
-    if args.command == "serve":
-        web_auth.serve()
-    elif args.command == "what":
-        current = interapp.get_current()
-        if args.json:
-            print(json.dumps(current, indent=2, sort_keys=True, separators=(',',': ')))
-        else:
-            print_current(current, include_newline=True)
-    elif args.command == "watch":
-        configure_terminal_for_single_char_input()
-        t = Thread(target=watch)
+    def on_track_change(previous, new):
+        if previous is not None:
+            # Print the previous song after it has finished playing
+            renderer.finish(previous, start_time[0], saved_cache.cached(previous["id"]) or False)
+        start_time[0] = localtime()
+        # Look up the saved status off the watcher thread; it's rendered once known
+        threading.Thread(target=saved_cache.is_saved, args=(new["id"],), daemon=True).start()
+
+    def on_tick(song):
+        renderer.render(song, start_time[0], saved_cache.cached(song["id"]) or False)
+
+    watcher.subscribe("track", on_track_change)
+    watcher.subscribe("tick", on_tick)
+
+    fd = sys.stdin.fileno()
+    old_terminal_settings = termios.tcgetattr(fd)
+    try:
+        tty.setraw(fd)
+        t = threading.Thread(target=watcher.run)
         t.start()
         while True:
             ch = sys.stdin.read(1)
+            current = watcher.current
             if ch == 'x' or ch == 'q':
                 sys.stdout.write("\r\n")
                 sys.stdout.flush()
-                watching = False
+                watcher.stop()
                 break
             elif ch == ' ':
-                interapp.toggle_play_pause()
+                spotify.toggle_play_pause()
+                watcher.wake()
             elif ch == 'n':
-                interapp.play_next()
+                spotify.play_next()
+                watcher.wake()
             elif ch == 'p':
-                interapp.play_previous()
-            elif ch == 's':
-                id_to_save = interapp.get_current()["id"]
-                api.save_song(id_to_save)
-                known_saved.add(id_to_save)
-        restore_terminal_settings()
-    elif args.command == "cache":
-        api.cache_library(args.out)
-    elif args.command == "playlist":
-        title = args.title
-        with open(args.file, "r") as f:
-            ids = f.readlines()
-        ids = ["spotify:track:" + x.strip() for x in ids]
-        api.create_playlist(title, ids)
-    elif args.command == "singles":
-        if args.title is None:
-            if args.limit == 1:
-                args.title = "Single Songs"
-            elif args.limit == 2:
-                args.title = "Double Songs"
-            else:
-                args.title = "{} Songs".format(args.limit)
-        api.create_singles_playlist(args.limit, args.title, args.library, args.dry, args.verbose)
-    elif args.command == "save":
-        current = interapp.get_current()
-        print_current(current)
-        api.save_song(current['id'])
+                spotify.play_previous()
+                watcher.wake()
+            elif ch == 's' and current is not None:
+                save_queue.save(current["id"])
+                watcher.wake()
+            elif ch == 'u' and current is not None:
+                save_queue.unsave(current["id"])
+                watcher.wake()
+    finally:
+        watcher.stop()
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_terminal_settings)
+        sys.stdout.flush()
+    save_queue.flush()
+
+def command_cache(ctx, args):
+    if args.from_store:
+        store = ctx.library_store(args.library)
+        store.export_json(args.out)
+        print("Wrote %d tracks to %s" % (store.count(), args.out))
+        return
+    ctx.api().cache_library(args.out, args.jobs, ctx.library_store(args.library), ctx.cache_checkpoint(), args.verbose)
+
+def command_playlist(ctx, args):
+    title = args.title
+    ids = read_track_ids(args.file)
+
+    if args.dry or args.validate:
+        tracks = ctx.resolver().resolve(ids, args.verbose)
+        for track_id, track in zip(ids, tracks):
+            if track is None:
+                print("Skipping %s: no such track" % track_id, file=sys.stderr)
+        if args.dry:
+            import shutil, songfmt
+            width = ctx.columns or shutil.get_terminal_size().columns
+            for track in tracks:
+                if track is not None:
+                    print(songfmt.format_song(track, width, include_time=False, include_pos=False))
+            print("%d of %d songs found" % (len(tracks) - tracks.count(None), len(lines)))
+            return
+        ids = [ track_id for track_id, track in zip(ids, tracks) if track is not None ]
+
+    ids = [ "spotify:track:" + track_id for track_id in ids ]
+    if args.sync is not None:
+        ctx.api().sync_playlist(args.sync, ids, args.verbose)
+    else:
+        ctx.api().create_playlist(title, ids, jobs=args.jobs, checkpoint=ctx.playlist_checkpoint(), log=args.verbose)
+
+def command_singles(ctx, args):
+    if args.title is None:
+        if args.limit == 1:
+            args.title = "Single Songs"
+        elif args.limit == 2:
+            args.title = "Double Songs"
+        else:
+            args.title = "{} Songs".format(args.limit)
+    store = ctx.library_store(args.library)
+    if args.import_json is not None:
+        store.import_json(args.import_json)
+    ctx.api().create_singles_playlist(args.limit, args.title, store, args.dry, args.verbose, args.jobs, ctx.playlist_checkpoint(), args.sync, args.reconcile)
+
+# The track IDs in a file of IDs, URIs or links, one per line, skipping (and
+# warning about) any line that is none of those
+def read_track_ids(path):
+    import resolver
+    with open(path, "r") as f:
+        lines = [ line.strip() for line in f if line.strip() ]
+    ids = []
+    for line in lines:
+        track_id = resolver.track_id(line)
+        if track_id is None:
+            print("Skipping %s: not a track ID" % line, file=sys.stderr)
+        else:
+            ids.append(track_id)
+    return ids
+
+def command_save(ctx, args):
+    if args.ids is not None:
+        save_queue = ctx.save_queue()
+        ids = read_track_ids(args.ids)
+        # The daemon shares the queue between requests, so only count the
+        # failures since ours were queued, and only for our tracks
+        before = len(save_queue.failed)
+        save_queue.save_many(ids)
+        save_queue.flush()
+        failed = set(save_queue.failed[before:])
+        print("Saved {} tracks".format(sum(1 for i in ids if i not in failed)))
+    else:
+        current = ctx.spotify().snapshot()
+        print_current(current, width=ctx.columns)
+        ctx.api().save_song(current['id'])
+        ctx.saved_cache().set(current['id'], True)
+
+def command_query(ctx, args):
+    import datetime, query
+    parse_date = lambda d: datetime.datetime.strptime(d, "%Y-%m-%d") if d is not None else None
+    if args.query == "top-artists" and (args.playlist is not None or args.sync is not None):
+        query_parser.error("--playlist and --sync need a query that returns songs, not top-artists")
+    store = ctx.library_store(args.library)
+    if args.update or args.reconcile:
+        ctx.api().update_library(store, args.verbose, reconcile=args.reconcile)
+    if args.query == "singles":
+        results = query.singles(store, args.limit if args.limit is not None else 1)
+    elif args.query == "top-artists":
+        results = query.top_artists(store, args.limit if args.limit is not None else 20)
+    elif args.query == "added":
+        results = query.added_between(store, parse_date(args.since), parse_date(args.until))
+    else:
+        results = query.duplicates(store)
+
+    if args.json:
+        import json
+        print(json.dumps([ r if isinstance(r, dict) else dict(r.simple(), added_at=r.added_at) for r in results ], indent=2, sort_keys=True))
+    elif args.query == "top-artists":
+        for group in results:
+            print("{:6} {}".format(group["count"], group["artist"]))
+    else:
+        import shutil, songfmt
+        width = ctx.columns or shutil.get_terminal_size().columns
+        for song in results:
+            print(songfmt.format_song(song, width, include_time=False, include_pos=False))
+
+    if (args.sync is not None or args.playlist is not None) and not results:
+        # Syncing to nothing would empty the playlist
+        print("No songs matched, so the playlist was left alone", file=sys.stderr)
+        return 1
+    uris = [ song.uri for song in results ]
+    if args.sync is not None:
+        ctx.api().sync_playlist(args.sync, uris, args.verbose)
+    elif args.playlist is not None:
+        ctx.api().create_playlist(args.playlist, uris, jobs=4, checkpoint=ctx.playlist_checkpoint(), log=args.verbose)
+
+# Each account directory holds a usertoken.txt and optionally a config.ini,
+# read over the main one. Its [FLEET] SINGLES_PLAYLIST, if set, is the ID of a
+# playlist to keep in sync rather than creating a new one each run.
+def command_fleet(ctx, args):
+    import fleet, transport
+    from configparser import ConfigParser
+    from time import monotonic
+    accounts_dir = args.accounts if args.accounts is not None else join(ctx.config_dir, "accounts")
+    steps = {
+            "update": lambda account: account.api().update_library(account.library_store(), args.verbose),
+            "reconcile": lambda account: account.api().reconcile_library(account.library_store(), args.verbose),
+            "singles": lambda account: account.api().create_singles_playlist(
+                args.limit, args.title, account.library_store(), args.dry, args.verbose, 1, account.playlist_checkpoint(),
+                account.config().get("FLEET", "SINGLES_PLAYLIST", fallback=None)),
+            }
+    names = [ step.strip() for step in args.steps.split(",") if step.strip() ]
+    for name in names:
+        if name not in steps:
+            print("Unknown step %s" % name, file=sys.stderr)
+            return 2
+
+    def make_context(name, http):
+        account = Context(join(accounts_dir, name), ctx.player_backend, args.verbose, ctx.columns)
+        config = ConfigParser()
+        config.read([ join(ctx.config_dir, "config.ini"), join(account.config_dir, "config.ini") ])
+        account.components["config"] = config
+        account.components["http"] = http
+        return account
+
+    # Every worker needs a pooled connection or it makes a new one per request
+    http = ctx.components["http"] = transport.from_config(ctx.config(), min_pool_size=args.workers)
+    start = monotonic()
+    reports = fleet.Fleet(fleet.find_accounts(accounts_dir), make_context, [ (name, steps[name]) for name in names ],
+                          http, args.workers, args.deadline, args.verbose).run()
+    fleet.print_reports(reports, monotonic() - start)
+    return 0 if all(r.status == "ok" for r in reports) else 1
+
+def command_daemon(ctx, args):
+    import daemon
+    if args.stop:
+        daemon.stop(ctx.config_dir)
     else:
+        daemon.serve(ctx)
+
+COMMANDS = {
+        "serve": command_serve,
+        "what": command_what,
+        "watch": command_watch,
+        "cache": command_cache,
+        "playlist": command_playlist,
+        "singles": command_singles,
+        "save": command_save,
+        "query": command_query,
+        "fleet": command_fleet,
+        "daemon": command_daemon
+        }
+
+# Commands that a running daemon can run on our behalf
+FORWARDED_COMMANDS = [ "what", "save", "cache", "playlist", "singles", "query" ]
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+    if args.command not in COMMANDS:
         parser.print_help()
+        return 0
+    # Stats are only kept by the process doing the work, so measure here
+    profile = args.stats or args.trace is not None
+    if args.command in FORWARDED_COMMANDS and not args.no_daemon and not profile:
+        import client
+        status = client.forward(args.config_dir, argv)
+        if status is not None:
+            return status
+    ctx = Context(args.config_dir, args.player, args.verbose)
+    if not profile:
+        return COMMANDS[args.command](ctx, args) or 0
+
+    import stats
+    recorded = stats.enable(trace=args.trace is not None)
+    try:
+        with stats.phase("command " + args.command):
+            return COMMANDS[args.command](ctx, args) or 0
+    finally:
+        stats.disable()
+        if args.stats:
+            recorded.print_summary(sys.stderr)
+        if args.trace is not None:
+            recorded.write_trace(args.trace)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+from time import monotonic, sleep
+
+DEFAULT_TTL = 600
+DEFAULT_MAX_SIZE = 50000
+# How long the first caller waits for others to join its batch
+DEFAULT_WINDOW = 0.02
+
+class _Batch:
+    def __init__(self):
+        self.ids = []
+        self.results = {}
+        self.done = threading.Event()
+
+# Caches whether tracks are saved in the user's library. Misses from
+# concurrent callers are coalesced into batched /me/tracks/contains requests;
+# entries expire after |ttl| seconds and the least recently used are evicted
+# beyond |max_size|.
+class SavedStatusCache:
+    def __init__(self, api, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, window=DEFAULT_WINDOW):
+        self.api = api
+        self.ttl = ttl
+        self.max_size = max_size
+        self.window = window
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.open_batch = None
+        self.in_flight = {}
+
+    def _cached(self, track_id):
+        entry = self.entries.get(track_id)
+        if entry is None:
+            return None
+        saved, expires = entry
+        if expires < monotonic():
+            del self.entries[track_id]
+            return None
+        self.entries.move_to_end(track_id)
+        return saved
+
+    def _store(self, track_id, saved):
+        self.entries[track_id] = (saved, monotonic() + self.ttl)
+        self.entries.move_to_end(track_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def set(self, track_id, saved):
+        with self.lock:
+            self._store(track_id, saved)
+
+    def set_many(self, track_ids, saved):
+        with self.lock:
+            for track_id in track_ids:
+                self._store(track_id, saved)
+
+    def forget(self, track_ids):
+        with self.lock:
+            for track_id in track_ids:
+                self.entries.pop(track_id, None)
+
+    def cached(self, track_id):
+        with self.lock:
+            return self._cached(track_id)
+
+    # Everything in the local library was saved when it was last synced
+    def seed(self, store):
+        self.set_many(reversed(store.track_ids()[:self.max_size]), True)
+
+    def is_saved(self, track_id):
+        return self.lookup([track_id])[0]
+
+    def lookup(self, track_ids):
+        results = {}
+        batches = set()
+        leader = None
+        with self.lock:
+            for track_id in track_ids:
+                saved = self._cached(track_id)
+                if saved is not None:
+                    results[track_id] = saved
+                elif track_id in self.in_flight:
+                    batches.add(self.in_flight[track_id])
+                else:
+                    if self.open_batch is None:
+                        self.open_batch = leader = _Batch()
+                    self.open_batch.ids.append(track_id)
+                    self.in_flight[track_id] = self.open_batch
+                    batches.add(self.open_batch)
+
+        if leader is not None:
+            self._run(leader)
+        for batch in batches:
+            batch.done.wait()
+            results.update(batch.results)
+        # Lookups that failed are reported as not saved but aren't cached
+        return [ results.get(track_id, False) for track_id in track_ids ]
+
+    def _run(self, batch):
+        sleep(self.window)
+        with self.lock:
+            self.open_batch = None
+        try:
+            saved = self.api.tracks_contain(batch.ids)
+            batch.results = dict(zip(batch.ids, saved))
+        except Exception:
+            batch.results = {}
+        with self.lock:
+            for track_id in batch.ids:
+                del self.in_flight[track_id]
+            for track_id, saved in batch.results.items():
+                self._store(track_id, saved)
+        batch.done.set()
@@ -0,0 +1,91 @@
+import queue
+import ratelimit
+import requests
+import threading
+from time import sleep
+
+SAVE_BATCH = 50
+DEFAULT_MAX_RETRIES = 5
+
+# Saves and unsaves tracks on a background thread so that callers never wait
+# on the network. Requests that arrive while a batch is being sent are
+# coalesced (the last request for a track wins) and sent in batches of up to
+# SAVE_BATCH IDs. The saved-status cache is updated as soon as a request is
+# queued.
+class SaveQueue:
+    def __init__(self, api, saved_cache=None, max_retries=DEFAULT_MAX_RETRIES, log=False):
+        self.api = api
+        self.saved_cache = saved_cache
+        self.max_retries = max_retries
+        self.log = log
+        self.queue = queue.Queue()
+        self.failed = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, track_id):
+        self._put(track_id, True)
+
+    def unsave(self, track_id):
+        self._put(track_id, False)
+
+    def save_many(self, track_ids):
+        for track_id in track_ids:
+            self.save(track_id)
+
+    def _put(self, track_id, saved):
+        if self.saved_cache is not None:
+            self.saved_cache.set(track_id, saved)
+        self.queue.put((track_id, saved))
+
+    # Blocks until everything queued so far has been sent
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            pending = [ self.queue.get() ]
+            while True:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            wanted = {}
+            for track_id, saved in pending:
+                wanted.pop(track_id, None)
+                wanted[track_id] = saved
+            to_save = [ t for t, saved in wanted.items() if saved ]
+            to_unsave = [ t for t, saved in wanted.items() if not saved ]
+            for i in range(0, len(to_save), SAVE_BATCH):
+                self._send(self.api.save_songs, to_save[i:i + SAVE_BATCH])
+            for i in range(0, len(to_unsave), SAVE_BATCH):
+                self._send(self.api.remove_songs, to_unsave[i:i + SAVE_BATCH])
+            for _ in pending:
+                self.queue.task_done()
+
+    def _send(self, method, ids):
+        for attempt in range(self.max_retries + 1):
+            try:
+                method(ids)
+                if self.log:
+                    print("Updated %d tracks" % len(ids))
+                return
+            except Exception as e:
+                if attempt == self.max_retries or not retryable(e):
+                    print("Failed to update %d tracks: %s" % (len(ids), e))
+                    self.failed.extend(ids)
+                    # We no longer know the real state of these tracks
+                    if self.saved_cache is not None:
+                        self.saved_cache.forget(ids)
+                    return
+                sleep(ratelimit.backoff(attempt))
+
+# Whether an update that failed with |e| might work if sent again. Saving and
+# removing are idempotent, so that is safe even if the first one was applied,
+# but anything else (e.g. a 400 for a bad ID) would fail the same way again.
+def retryable(e):
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
@@ -17,19 +17,14 @@ def duration_string(duration):
     duration = int(duration) # for rounding
     return "{:2}:{:02}".format(duration // 60, duration % 60)
 
-def simple_song_obj(track):
-    return {
-            "id": track["track"]["id"],
-            "uri": track["track"]["uri"],
-            "name": track["track"]["name"],
-            "duration": float(track["track"]["duration_ms"]) / 1000.0,
-            "artist": track["track"]["artists"][0]["name"],
-            "album": track["track"]["album"]["name"]
-            }
-
-
+def position_string(song, include_pos=True):
+    if include_pos:
+        return duration_string(song['position']) + " "
+    return " " * 6
 
-def format_song(song, width, include_time=True, start_time=localtime(), saved=False, include_pos=True):
+# Splits a formatted song into the text before the position, the position and
+# the text after it, so that the static parts can be reused while playing
+def format_segments(song, width, include_time=True, start_time=localtime(), saved=False, include_pos=True):
     title_width = width // 3
     artist_width = width // 3
 
@@ -40,16 +35,16 @@ def format_song(song, width, include_time=True, start_time=localtime(), saved=Fa
 
     duration = duration_string(song['duration']) + " "
 
-    time_str = ""
     if include_time:
-        time_str += "[{}] ".format(strftime("%H:%M", start_time))
+        time_str = "[{}] ".format(strftime("%H:%M", start_time))
     else:
-        time_str += " " * 8
-    if include_pos:
-        time_str += duration_string(song['position']) + " "
-    else:
-        time_str += " " * 6
-    up_to_album = savedString + time_str + duration + title + artist
+        time_str = " " * 8
+    prefix = savedString + time_str
+    pos = position_string(song, include_pos)
+    up_to_album = prefix + pos + duration + title + artist
     album = fixed_length(song['album'], width - 1 - len(up_to_album))
 
-    return up_to_album + album
+    return prefix, pos, duration + title + artist + album
+
+def format_song(song, width, include_time=True, start_time=localtime(), saved=False, include_pos=True):
+    return "".join(format_segments(song, width, include_time, start_time, saved, include_pos))
@@ -0,0 +1,221 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [ 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000 ]
+
+ID_SEGMENT = re.compile(r"^[0-9A-Za-z]{16,}$")
+# Segments following these are IDs whatever they look like
+ID_PARENTS = { "users", "playlists", "albums", "artists" }
+
+# The endpoint a request went to, with IDs replaced so that e.g. every playlist
+# upload is counted together: 'POST /v1/playlists/{id}/tracks'
+def endpoint(method, uri):
+    path = uri.split("://", 1)[-1].split("?", 1)[0]
+    segments = path.split("/")[1:]
+    for i, segment in enumerate(segments):
+        if ID_SEGMENT.match(segment) or (i > 0 and segments[i - 1] in ID_PARENTS):
+            segments[i] = "{id}"
+    return "%s /%s" % (method, "/".join(segments))
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def histogram(seconds):
+    counts = [ 0 ] * (len(BUCKETS_MS) + 1)
+    for s in seconds:
+        ms = s * 1000
+        counts[next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))] += 1
+    return { ("<=%d" % bound if i < len(BUCKETS_MS) else ">%d" % BUCKETS_MS[-1]): n
+             for i, (bound, n) in enumerate(zip(BUCKETS_MS + [ None ], counts)) if n }
+
+class Endpoint:
+    def __init__(self):
+        self.statuses = Counter()
+        self.seconds = []
+        self.sent = 0
+        self.received = 0
+
+    def summary(self):
+        return {
+                "count": len(self.seconds),
+                "statuses": dict(self.statuses),
+                "bytes_sent": self.sent,
+                "bytes_received": self.received,
+                "seconds": sum(self.seconds),
+                "p50_ms": percentile(self.seconds, 0.5) * 1000,
+                "p95_ms": percentile(self.seconds, 0.95) * 1000,
+                "max_ms": max(self.seconds, default=0) * 1000,
+                "histogram_ms": histogram(self.seconds),
+                }
+
+class Phase:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+
+# Handed to the body of a phase() so that it can add to the bytes counted
+class PhaseRecord:
+    def __init__(self):
+        self.bytes = 0
+
+    def add_bytes(self, n):
+        self.bytes += n
+
+# Everything recorded while enabled. Times are seconds from perf_counter; with
+# |trace| every request, retry and phase is also kept as a trace event.
+class Stats:
+    def __init__(self, trace=False):
+        self.lock = threading.Lock()
+        self.started = perf_counter()
+        self.endpoints = {}
+        self.retries = Counter()
+        self.waited = Counter()
+        self.phases = {}
+        self.counters = Counter()
+        self.events = [] if trace else None
+
+    def event(self, name, category, start, duration=None, args=None):
+        if self.events is None:
+            return
+        e = { "name": name, "cat": category, "ts": (start - self.started) * 1e6,
+              "pid": os.getpid(), "tid": threading.get_ident(), "args": args or {} }
+        if duration is None:
+            e.update(ph="i", s="t")
+        else:
+            e.update(ph="X", dur=duration * 1e6)
+        self.events.append(e)
+
+    def request(self, method, uri, status, start, seconds, sent, received):
+        name = endpoint(method, uri)
+        with self.lock:
+            e = self.endpoints.setdefault(name, Endpoint())
+            e.statuses[str(status)] += 1
+            e.seconds.append(seconds)
+            e.sent += sent
+            e.received += received
+            self.event(name, "http", start, seconds, { "status": status, "bytes": received })
+
+    # |reason| is e.g. '429', |seconds| how long the retry was held back
+    def retry(self, reason, seconds):
+        with self.lock:
+            self.retries[reason] += 1
+            self.waited[reason] += seconds
+            self.event("retry " + reason, "retry", perf_counter(), args={ "wait": seconds })
+
+    def wait(self, reason, seconds):
+        with self.lock:
+            self.waited[reason] += seconds
+
+    def count(self, name, n):
+        with self.lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def phase(self, name):
+        record = PhaseRecord()
+        start = perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = perf_counter() - start
+            with self.lock:
+                p = self.phases.setdefault(name, Phase())
+                p.count += 1
+                p.seconds += seconds
+                p.bytes += record.bytes
+                self.event(name, "phase", start, seconds, { "bytes": record.bytes })
+
+    def summary(self):
+        with self.lock:
+            return {
+                    "seconds": perf_counter() - self.started,
+                    "requests": { name: e.summary() for name, e in sorted(self.endpoints.items()) },
+                    "retries": dict(self.retries),
+                    "waited_seconds": dict(self.waited),
+                    "phases": { name: { "count": p.count, "seconds": p.seconds, "bytes": p.bytes }
+                                for name, p in sorted(self.phases.items()) },
+                    "counters": dict(self.counters),
+                    }
+
+    def print_summary(self, out):
+        s = self.summary()
+        requests = s["requests"].values()
+        print("%d requests, %d bytes received, in %.2fs" % (sum(r["count"] for r in requests),
+              sum(r["bytes_received"] for r in requests), s["seconds"]), file=out)
+        if s["requests"]:
+            print("\n%-40s %6s %8s %8s %8s %10s  %s" % ("endpoint", "count", "p50 ms", "p95 ms", "max ms", "received", "statuses"), file=out)
+            for name, r in s["requests"].items():
+                statuses = " ".join("%s:%d" % item for item in sorted(r["statuses"].items()))
+                print("%-40s %6d %8.1f %8.1f %8.1f %10d  %s" % (name, r["count"], r["p50_ms"], r["p95_ms"], r["max_ms"],
+                      r["bytes_received"], statuses), file=out)
+        if s["retries"] or s["waited_seconds"]:
+            print("\n%-40s %6s %8s" % ("retries and waits", "count", "seconds"), file=out)
+            for reason in sorted(set(s["retries"]) | set(s["waited_seconds"])):
+                print("%-40s %6d %8.2f" % (reason, s["retries"].get(reason, 0), s["waited_seconds"].get(reason, 0)), file=out)
+        if s["phases"]:
+            print("\n%-40s %6s %8s %10s" % ("phase", "count", "seconds", "bytes"), file=out)
+            for name, p in s["phases"].items():
+                print("%-40s %6d %8.2f %10d" % (name, p["count"], p["seconds"], p["bytes"]), file=out)
+        for name, n in sorted(s["counters"].items()):
+            print("%s: %d" % (name, n), file=out)
+
+    # Writes the trace in the Chrome trace event format, which chrome://tracing
+    # and Perfetto load, with the summary alongside
+    def write_trace(self, path):
+        summary = self.summary()
+        with self.lock:
+            events = list(self.events or [])
+        with open(path, "w") as f:
+            json.dump({ "traceEvents": events, "displayTimeUnit": "ms", "stats": summary }, f)
+
+_current = None
+
+def enable(trace=False):
+    global _current
+    _current = Stats(trace)
+    return _current
+
+def disable():
+    global _current
+    _current = None
+
+def current():
+    return _current
+
+# The hooks below do nothing unless enable() has been called
+
+def request(method, uri, status, start, seconds, sent=0, received=0):
+    if _current is not None:
+        _current.request(method, uri, status, start, seconds, sent, received)
+
+def retry(reason, seconds=0.0):
+    if _current is not None:
+        _current.retry(reason, seconds)
+
+def wait(reason, seconds):
+    if _current is not None:
+        _current.wait(reason, seconds)
+
+def count(name, n=1):
+    if _current is not None:
+        _current.count(name, n)
+
+_IGNORED = PhaseRecord()
+
+@contextmanager
+def phase(name):
+    if _current is None:
+        yield _IGNORED
+        return
+    with _current.phase(name) as record:
+        yield record
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the parts of the Spotify Web API that Ravenglass uses,
+# for benchmarks and for trying Ravenglass out offline. Point Ravenglass at it
+# with the environment variables printed on start-up.
+#
+# It serves a synthetic library and supports paging, saving and removing
+# songs, /tracks lookups and playlist edits, with optional per-request latency,
+# access tokens that stop working after a while (without saying so in
+# 'expires_in', so clients see 401s) and a rate limit answered with 429s and
+# Retry-After.
+
+import argparse
+import json
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, strftime, gmtime
+
+INITIAL_TOKEN = "stub-token"
+REFRESH_TOKEN = "stub-refresh"
+USER_ID = "stub-user"
+
+def track_id(n):
+    return "stub%018d" % n
+
+def track_object(n, album, artist):
+    return {
+            "id": track_id(n),
+            "uri": "spotify:track:" + track_id(n),
+            "name": "Synthetic Song %d" % n,
+            "duration_ms": 120000 + (n * 7919) % 240000,
+            "artists": [ { "id": "stubartist%014d" % artist, "name": "Synthetic Artist %d" % artist } ],
+            "album": { "id": "stubalbum%015d" % album, "name": "Synthetic Album %d" % album },
+            }
+
+# Saved-track objects, newest first, shaped like a real library: most albums
+# have one or two saved songs, some have many, and artists have several albums.
+# Songs from the same album are often saved at the same time.
+def synthetic_library(size, seed=0):
+    rng = random.Random(seed)
+    items = []
+    album = 0
+    added_at = 1600000000
+    while len(items) < size:
+        saved = min(size - len(items), rng.choice([ 1, 1, 1, 1, 2, 2, 3, 5, 8, 12 ]))
+        artist = album // 3 if rng.random() < 0.5 else rng.randrange(album // 3 + 1)
+        together = rng.random() < 0.3
+        for _ in range(saved):
+            n = len(items)
+            items.append({ "added_at": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(added_at)), "track": track_object(n, album, artist) })
+            if not together:
+                added_at -= rng.randrange(60, 86400)
+        added_at -= rng.randrange(60, 86400)
+        album += 1
+    return items
+
+class StubState:
+    def __init__(self, library, latency=0.0, token_ttl=None, rate_limit=None):
+        self.lock = threading.Lock()
+        self.library = library
+        self.saved = { item["track"]["id"]: item for item in library }
+        self.tracks = { item["track"]["id"]: item["track"] for item in library }
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.rate_limit = rate_limit
+        self.tokens = { INITIAL_TOKEN: monotonic() }
+        self.recent = []
+        self.playlists = {}
+        self.requests = 0
+        self.unauthorised = 0
+        self.throttled = 0
+
+    def token_valid(self, token):
+        issued = self.tokens.get(token)
+        return issued is not None and (self.token_ttl is None or monotonic() - issued < self.token_ttl)
+
+    # Whether a request now would take us over |rate_limit| a second
+    def over_limit(self):
+        if self.rate_limit is None:
+            return False
+        now = monotonic()
+        self.recent = [ t for t in self.recent if now - t < 1 ]
+        if len(self.recent) >= self.rate_limit:
+            return True
+        self.recent.append(now)
+        return False
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in one write, without waiting on Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None, headers={}):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if state.latency:
+            sleep(state.latency)
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        with state.lock:
+            state.requests += 1
+            if url.path == "/api/token":
+                return self.token(state, dict(urllib.parse.parse_qsl(body.decode("utf-8"))))
+            if state.over_limit():
+                state.throttled += 1
+                return self.reply(429, { "error": { "status": 429 } }, { "Retry-After": "1" })
+            auth = self.headers.get("Authorization", "")
+            if not auth.startswith("Bearer ") or not state.token_valid(auth[len("Bearer "):]):
+                state.unauthorised += 1
+                return self.reply(401, { "error": { "status": 401, "message": "The access token expired" } })
+            data = json.loads(body) if body else None
+            path = url.path[len("/v1"):] if url.path.startswith("/v1/") else url.path
+            return self.route(state, method, path, query, data)
+
+    def token(self, state, form):
+        if form.get("grant_type") not in ("refresh_token", "authorization_code"):
+            return self.reply(400, { "error": "unsupported_grant_type" })
+        token = "stub-%d" % len(state.tokens)
+        state.tokens[token] = monotonic()
+        # Claim an hour whatever |token_ttl| is, as a token revoked early would
+        return self.reply(200, { "access_token": token, "token_type": "Bearer", "expires_in": 3600,
+                                 "refresh_token": REFRESH_TOKEN })
+
+    def route(self, state, method, path, query, data):
+        parts = path.strip("/").split("/")
+        if method == "GET" and path == "/me":
+            return self.reply(200, { "id": USER_ID })
+        if path == "/me/tracks/contains":
+            return self.reply(200, [ i in state.saved for i in query["ids"].split(",") ])
+        if path == "/me/tracks":
+            if method == "GET":
+                return self.page(state.library, query, "/me/tracks")
+            ids = query["ids"].split(",")
+            if method == "PUT":
+                added_at = strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())
+                new = [ { "added_at": added_at, "track": state.tracks[i] } for i in ids if i in state.tracks and i not in state.saved ]
+                state.saved.update((item["track"]["id"], item) for item in new)
+                state.library[:0] = new
+            elif method == "DELETE":
+                for i in ids:
+                    state.saved.pop(i, None)
+                state.library[:] = [ item for item in state.library if item["track"]["id"] in state.saved ]
+            return self.reply(200)
+        if method == "GET" and path == "/tracks":
+            return self.reply(200, { "tracks": [ state.tracks.get(i) for i in query["ids"].split(",") ] })
+        if method == "POST" and len(parts) == 3 and parts[0] == "users" and parts[2] == "playlists":
+            playlist_id = "stubplaylist%010d" % len(state.playlists)
+            state.playlists[playlist_id] = { "uris": [], "snapshot": 0 }
+            return self.reply(201, { "id": playlist_id, "name": data.get("name") })
+        if parts[0] == "playlists" and len(parts) >= 2 and parts[1] in state.playlists:
+            return self.playlist(state, parts[1], method, parts[2:], query, data)
+        return self.reply(404, { "error": { "status": 404, "message": "Not stubbed: %s %s" % (method, path) } })
+
+    def page(self, items, query, path):
+        offset = int(query.get("offset", 0))
+        limit = min(int(query.get("limit", 20)), 50)
+        end = offset + limit
+        base = "http://%s:%d/v1%s" % (self.server.server_address[0], self.server.server_address[1], path)
+        return self.reply(200, { "items": items[offset:end], "total": len(items), "offset": offset, "limit": limit,
+                                 "next": base + "?offset=%d&limit=%d" % (end, limit) if end < len(items) else None })
+
+    def playlist(self, state, playlist_id, method, rest, query, data):
+        playlist = state.playlists[playlist_id]
+        uris = playlist["uris"]
+        if method == "GET" and not rest:
+            return self.reply(200, { "snapshot_id": str(playlist["snapshot"]), "tracks": { "total": len(uris) } })
+        if rest != [ "tracks" ]:
+            return self.reply(404, { "error": { "status": 404 } })
+        if method == "GET":
+            items = [ { "track": { "uri": uri } } for uri in uris ]
+            return self.page(items, query, "/playlists/%s/tracks" % playlist_id)
+        if method == "POST":
+            position = data.get("position", len(uris))
+            if position > len(uris) or len(data["uris"]) > 100:
+                return self.reply(400, { "error": { "status": 400, "message": "Index out of bounds" } })
+            uris[position:position] = data["uris"]
+        elif method == "PUT" and "uris" in data:
+            uris[:] = data["uris"]
+        elif method == "PUT":
+            start, before = data["range_start"], data["insert_before"]
+            length = data.get("range_length", 1)
+            moved = uris[start:start + length]
+            del uris[start:start + length]
+            at = before - length if before > start else before
+            uris[at:at] = moved
+        elif method == "DELETE":
+            positions = { p for t in data["tracks"] for p in t.get("positions", []) }
+            removed = { t["uri"] for t in data["tracks"] if "positions" not in t }
+            uris[:] = [ u for i, u in enumerate(uris) if i not in positions and u not in removed ]
+        playlist["snapshot"] += 1
+        return self.reply(200 if method != "POST" else 201, { "snapshot_id": str(playlist["snapshot"]) })
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, state, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.state = state
+
+    def api_root(self):
+        return "http://127.0.0.1:%d/v1" % self.server_address[1]
+
+    def accounts_root(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    # Serves on a background thread until shutdown()
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(prog="stubapi", description="Local stand-in for the Spotify Web API")
+    parser.add_argument("--port", default=8765, type=int, help="Port to listen on")
+    parser.add_argument("--tracks", default=1000, type=int, help="Number of saved songs in the synthetic library")
+    parser.add_argument("--latency", default=0.0, type=float, help="Seconds added to every request")
+    parser.add_argument("--token-ttl", default=None, type=float, help="Seconds before access tokens stop working")
+    parser.add_argument("--rate-limit", default=None, type=int, help="Requests per second before answering 429")
+    args = parser.parse_args()
+
+    server = StubServer(StubState(synthetic_library(args.tracks), args.latency, args.token_ttl, args.rate_limit), args.port)
+    print("RAVENGLASS_API_ROOT=%s RAVENGLASS_ACCOUNTS_ROOT=%s" % (server.api_root(), server.accounts_root()))
+    print("Put these two lines in usertoken.txt:\n%s\n%s" % (INITIAL_TOKEN, REFRESH_TOKEN))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import threading
+
+# Sends everything a command prints to whichever stream the thread running it
+# has redirected to, e.g. the client the daemon is running it for or an
+# account's report in a fleet run. Output from other threads goes to
+# |default|.
+class ThreadLocalStream:
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, "stream", None) or self.default
+
+    def redirect(self, stream):
+        self.local.stream = stream
+
+    def write(self, s):
+        return self.target().write(s)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
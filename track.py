@@ -0,0 +1,67 @@
+import json
+
+# A saved track, keeping only the fields that Ravenglass uses (those of
+# simple() plus the IDs and time it was saved). The full saved track object
+# from the API isn't kept as a dictionary: it is loaded on demand by
+# |load_raw|, e.g. from the library store, or held as its JSON text only when
+# asked for with |keep_raw|, as the library store needs it to write a track.
+# That text is many times the size of the rest of the Track.
+#
+# Tracks can be indexed like the dictionaries from simple(), so they can be
+# passed straight to songfmt.format_song.
+class Track:
+    __slots__ = ("id", "uri", "name", "artist", "album", "duration", "added_at",
+                 "album_id", "artist_id", "raw_json", "load_raw")
+
+    def __init__(self, id, uri, name, artist, album, duration, added_at=None,
+                 album_id=None, artist_id=None, raw_json=None, load_raw=None):
+        self.id = id
+        self.uri = uri
+        self.name = name
+        self.artist = artist
+        self.album = album
+        self.duration = duration
+        self.added_at = added_at
+        self.album_id = album_id
+        self.artist_id = artist_id
+        self.raw_json = raw_json
+        self.load_raw = load_raw
+
+    @classmethod
+    def from_saved_track(cls, saved_track, keep_raw=False):
+        return cls.from_track(saved_track["track"], saved_track.get("added_at"),
+                              json.dumps(saved_track, sort_keys=True) if keep_raw else None)
+
+    # From a track object, e.g. from /tracks, which hasn't necessarily been saved
+    @classmethod
+    def from_track(cls, track, added_at=None, raw_json=None):
+        artist = track["artists"][0] if track["artists"] else {}
+        return cls(track["id"], track["uri"], track["name"], artist.get("name"),
+                   track["album"]["name"], float(track["duration_ms"]) / 1000.0,
+                   added_at, track["album"]["id"], artist.get("id"), raw_json)
+
+    # The saved track object from the API
+    @property
+    def raw(self):
+        if self.raw_json is None and self.load_raw is not None:
+            return json.loads(self.load_raw(self.id))
+        return json.loads(self.raw_json) if self.raw_json is not None else None
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def simple(self):
+        return {
+                "id": self.id,
+                "uri": self.uri,
+                "name": self.name,
+                "duration": self.duration,
+                "artist": self.artist,
+                "album": self.album
+                }
+
+    def __repr__(self):
+        return "Track(%r, %r, %r)" % (self.id, self.name, self.artist)
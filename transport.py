@@ -0,0 +1,134 @@
+import os
+import ratelimit
+import requests
+import stats
+from requests.adapters import HTTPAdapter
+from time import perf_counter, sleep
+
+# Can be pointed elsewhere, e.g. at stubapi.py for benchmarks
+API_ROOT = os.environ.get("RAVENGLASS_API_ROOT", "https://api.spotify.com/v1")
+ACCOUNTS_ROOT = os.environ.get("RAVENGLASS_ACCOUNTS_ROOT", "https://accounts.spotify.com")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 3
+# Requests that can be sent again after a timeout or server error without
+# risking doing something twice (e.g. creating two playlists)
+IDEMPOTENT_METHODS = { "GET", "HEAD" }
+
+# One keep-alive session shared by every WebApi/WebAuth request so that we only
+# pay for the TCP and TLS handshakes once per host rather than once per call.
+# Every request is paced by |limiter|, so a Retry-After seen by any thread holds
+# back all of them, not just the one that was throttled.
+class Transport:
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, limiter=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter if limiter is not None else ratelimit.RateLimiter()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # |oauth| is a WebAuth; when given, the bearer token is attached and a 401
+    # triggers a single token refresh and retry. 429s honour Retry-After (or
+    # back off if there isn't one) and 5xx/connection errors back off
+    # exponentially with jitter, up to |max_retries| times. As a POST, PUT or
+    # DELETE that failed may still have been applied, those are only retried
+    # if they never connected.
+    def request(self, method, uri, oauth=None, log=False, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        headers = kwargs.pop("headers", None) or {}
+        idempotent = method in IDEMPOTENT_METHODS
+        refreshed = False
+        attempt = 0
+        while True:
+            start = perf_counter()
+            self.limiter.acquire()
+            stats.wait("pacing", perf_counter() - start)
+            if oauth is not None:
+                token = oauth.oauth()
+                headers["Authorization"] = "Bearer " + token
+            start = perf_counter()
+            try:
+                r = self.session.request(method, uri, headers=headers, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                stats.request(method, uri, type(e).__name__, start, perf_counter() - start)
+                if attempt >= self.max_retries or not (idempotent or isinstance(e, requests.exceptions.ConnectTimeout)):
+                    raise
+                if log:
+                    print("Connection failed; retrying")
+                delay = ratelimit.backoff(attempt)
+                stats.retry("connection", delay)
+                sleep(delay)
+                attempt += 1
+                continue
+            if stats.current() is not None:
+                body = r.request.body
+                stats.request(method, uri, r.status_code, start, perf_counter() - start,
+                              len(body) if body is not None else 0, len(r.content))
+
+            if r.status_code == 401 and oauth is not None and not refreshed:
+                if log:
+                    print("Refreshing token")
+                stats.retry("401")
+                oauth.update_token(token)
+                refreshed = True
+            elif r.status_code == 429 and attempt < self.max_retries:
+                delay = retry_after(r, attempt)
+                if log:
+                    print("Sleep for " + str(delay))
+                stats.retry("429", delay)
+                self.limiter.throttled(delay)
+                attempt += 1
+            elif r.status_code >= 500 and idempotent and attempt < self.max_retries:
+                if log:
+                    print("Server error %d; retrying" % r.status_code)
+                delay = ratelimit.backoff(attempt)
+                stats.retry("5xx", delay)
+                sleep(delay)
+                attempt += 1
+            else:
+                if r.status_code < 400:
+                    self.limiter.succeeded()
+                return r
+
+    def get(self, uri, **kwargs):
+        return self.request("GET", uri, **kwargs)
+
+    def put(self, uri, **kwargs):
+        return self.request("PUT", uri, **kwargs)
+
+    def post(self, uri, **kwargs):
+        return self.request("POST", uri, **kwargs)
+
+    def delete(self, uri, **kwargs):
+        return self.request("DELETE", uri, **kwargs)
+
+# Seconds to wait after a 429. Spotify sends Retry-After in seconds, but
+# without one (or with one we can't read) back off rather than retrying at once.
+def retry_after(r, attempt):
+    try:
+        return max(float(r.headers["Retry-After"]), 0)
+    except (KeyError, ValueError):
+        return ratelimit.BACKOFF_BASE * 2 ** attempt
+
+_shared = None
+
+def shared():
+    global _shared
+    if _shared is None:
+        _shared = Transport()
+    return _shared
+
+# |min_pool_size| is the number of threads that will be making requests at
+# once, as connections beyond the pool size are closed after every request
+def from_config(config, min_pool_size=0):
+    global _shared
+    _shared = Transport(pool_size=max(min_pool_size, config.getint("HTTP", "POOL_SIZE", fallback=DEFAULT_POOL_SIZE)),
+                        timeout=config.getfloat("HTTP", "TIMEOUT", fallback=DEFAULT_TIMEOUT),
+                        max_retries=config.getint("HTTP", "MAX_RETRIES", fallback=DEFAULT_MAX_RETRIES),
+                        limiter=ratelimit.RateLimiter(rate=config.getfloat("HTTP", "RATE", fallback=ratelimit.DEFAULT_RATE),
+                                                      burst=config.getint("HTTP", "BURST", fallback=ratelimit.DEFAULT_BURST),
+                                                      max_rate=config.getfloat("HTTP", "MAX_RATE", fallback=ratelimit.DEFAULT_MAX_RATE)))
+    return _shared
@@ -0,0 +1,113 @@
+import threading
+from math import floor
+from time import monotonic
+
+# A position more than this many seconds away from where we expect it to be
+# means the user has seeked (or the track restarted), so metadata is refetched
+JUMP_TOLERANCE = 2.0
+# Polling backs off from |interval| up to these limits while nothing is playing.
+# Paused and stopped are capped low so that we notice playback starting quickly.
+MAX_PAUSED_INTERVAL = 2.0
+MAX_CLOSED_INTERVAL = 60.0
+
+# Polls a Player and notifies subscribers of changes. Each poll is only the
+# cheap probe() of state, track ID and position; the full snapshot() is only
+# fetched when the track changes or the position jumps.
+#
+# Events:
+# * 'track' (previous, current): a new track started; previous may be None
+# * 'tick' (current): the position of the current track was updated
+# * 'state' (state): the player changed between 'playing', 'paused',
+#   'stopped' and None (not running)
+class Watcher:
+    def __init__(self, player, interval=1.0):
+        self.player = player
+        self.interval = interval
+        self.listeners = { "track": [], "tick": [], "state": [] }
+        self.current = None
+        self.state = None
+        self.idle_delay = interval
+        self.last_probe = None
+        self.running = False
+        self.wakeup = threading.Event()
+
+    def subscribe(self, event, callback):
+        self.listeners[event].append(callback)
+
+    def emit(self, event, *args):
+        for callback in self.listeners[event]:
+            callback(*args)
+
+    # Polls again immediately, e.g. after a key press changed the player
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def run(self):
+        self.running = True
+        while self.running:
+            delay = self.poll()
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    # Polls once and returns how long to wait before polling again
+    def poll(self):
+        probe = self.player.probe()
+        now = monotonic()
+        state, track_id, position = probe if probe is not None else (None, None, None)
+        if state != self.state:
+            self.state = state
+            self.idle_delay = self.interval
+            self.emit("state", state)
+
+        if track_id is None:
+            self.last_probe = None
+            # Only a closed player is slow to come back; a stopped one may start
+            # playing from the app at any moment
+            return self._back_off(MAX_CLOSED_INTERVAL if state is None else MAX_PAUSED_INTERVAL)
+
+        current = self.current
+        expected = None
+        if current is not None and self.last_probe is not None:
+            expected = current["position"]
+            if state == "playing":
+                expected += now - self.last_probe
+        self.last_probe = now
+
+        if current is None or current["id"] != track_id:
+            self._refresh(current)
+        elif expected is None:
+            # Nothing to compare with after the player stopped or closed, so
+            # fetch the position afresh
+            self._refresh(None)
+        elif abs(position - expected) > JUMP_TOLERANCE:
+            # Restarting the same track counts as a new one
+            self._refresh(current if position < JUMP_TOLERANCE and position < expected else None)
+        else:
+            current["position"] = position
+        if self.current is not None:
+            self.emit("tick", self.current)
+
+        if state != "playing":
+            return self._back_off(MAX_PAUSED_INTERVAL)
+        # Poll just after the displayed position next changes
+        if self.interval >= 1:
+            return self.interval - (position - floor(position))
+        return self.interval
+
+    def _refresh(self, previous):
+        snapshot = self.player.snapshot()
+        if snapshot is None:
+            return
+        same_track = previous is None and self.current is not None and self.current["id"] == snapshot["id"]
+        self.current = snapshot
+        if not same_track:
+            self.emit("track", previous, snapshot)
+
+    def _back_off(self, limit):
+        delay = self.idle_delay
+        self.idle_delay = min(self.idle_delay * 2, limit)
+        return delay
@@ -1,169 +1,490 @@
 import datetime
-import requests
+import hashlib
 import urllib
 import json
+import library
+import os
 import shutil
+import threading
+import query
 import songfmt
+import transport
+from track import Track
+from playlistdiff import playlist_diff
+from concurrent.futures import ThreadPoolExecutor
+from transport import API_ROOT
 from time import strftime, localtime
-from operator import itemgetter
+
+PAGE_SIZE = 50
+# Maximum number of IDs accepted by /me/tracks/contains
+CONTAINS_BATCH = 50
+# Maximum number of IDs accepted by /tracks
+TRACKS_BATCH = 50
+# Maximum number of tracks that can be added to a playlist in one request
+PLAYLIST_CHUNK = 100
 
 def parse(s):
     return datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%SZ" )
 
+# Appends the songs added at or after |since| as Tracks and returns True if any
+# were older, i.e. there is no need to fetch further pages
+def extend_since(all_songs, new_songs, since, keep_raw=False):
+    if since is None:
+        all_songs.extend(Track.from_saved_track(s, keep_raw) for s in new_songs)
+        return False
+    filtered = [ Track.from_saved_track(s, keep_raw) for s in new_songs if parse(s['added_at']) >= since ]
+    all_songs.extend(filtered)
+    return len(filtered) != len(new_songs)
+
+# Whether a cache run checkpointed in |state| has written |saved_track|. The
+# library is newest first, so that is everything added after the last track
+# written, as well as the tracks written with the same 'added_at'.
+def already_cached(state, saved_track):
+    if state["added_at"] is None:
+        return False
+    added_at = saved_track['added_at']
+    return added_at > state["added_at"] or (added_at == state["added_at"] and saved_track['track']['id'] in state["ids"])
+
 class WebApi:
-    def __init__(self, auth):
+    def __init__(self, auth, http=None, cache=None):
         self.auth = auth
+        self.http = http if http is not None else transport.shared()
+        self.cache = cache
+        self.user_id = None
 
-    def is_saved(self, trackID, try_again=True):
-        params = { "ids": trackID }
-        headers = { "Authorization": "Bearer " + self.auth.oauth() }
-        uri = "https://api.spotify.com/v1/me/tracks/contains"
-        r = requests.get(uri, params=params, headers=headers)
-        if r.status_code == 401 and try_again:
-            self.auth.update_token()
-            return self.is_saved(trackID, False)
-        elif r.status_code != 200:
+    # All API traffic goes through here so that it shares the pooled session
+    # and the 401/429/5xx handling in Transport. |path| may be an absolute URI
+    # (e.g. a 'next' link) or relative to the API root. With an HttpCache, GETs
+    # may be answered from it and anything else invalidates what it changes.
+    def request(self, method, path, **kwargs):
+        uri = path if path.startswith("http") else API_ROOT + path
+        if self.cache is None:
+            return self.http.request(method, uri, oauth=self.auth, **kwargs)
+        if method == "GET":
+            send = lambda headers: self.http.request(method, uri, oauth=self.auth, headers=headers, **kwargs)
+            return self.cache.get(uri, kwargs.get("params"), send)
+        r = self.http.request(method, uri, oauth=self.auth, **kwargs)
+        self.cache.changed(uri)
+        return r
+
+    def is_saved(self, trackID):
+        r = self.request("GET", "/me/tracks/contains", params={ "ids": trackID })
+        if r.status_code != 200:
             return False
         else:
             return r.json()[0]
 
-    def save_song(self, trackID, try_again=True):
-        params = { "ids": trackID }
-        headers = { "Authorization": "Bearer " + self.auth.oauth() }
-        uri = 'https://api.spotify.com/v1/me/tracks'
-        r = requests.put(uri, params=params, headers=headers)
+    # Returns whether each of |ids| is saved, in batches of CONTAINS_BATCH
+    def tracks_contain(self, ids):
+        saved = []
+        for i in range(0, len(ids), CONTAINS_BATCH):
+            r = self.request("GET", "/me/tracks/contains", params={ "ids": ",".join(ids[i:i + CONTAINS_BATCH]) })
+            r.raise_for_status()
+            saved.extend(r.json())
+        return saved
+
+    # Returns the track object for each of up to TRACKS_BATCH |ids|, or None
+    # for those that don't exist
+    def get_tracks(self, ids):
+        r = self.request("GET", "/tracks", params={ "ids": ",".join(ids) })
+        r.raise_for_status()
+        return r.json()["tracks"]
+
+    def save_song(self, trackID):
+        r = self.request("PUT", "/me/tracks", params={ "ids": trackID })
         if r.status_code == 401:
-            if try_again:
-                print("Going to try again with a new token")
-                self.auth.update_token()
-                self.save_song(trackID, False)
-            else:
-                print("Failed to save; not trying again. Try reauthorisation")
+            print("Failed to save. Try reauthorisation")
         elif r.status_code != 200:
             print("Failed with code %d:" % r.status_code)
             print(r.json())
 
-    def cache_library(self, destination):
-        all_songs = self.fetch_library(True)
-        if destination != None:
-            with open(destination, 'w') as f:
-                json.dump(all_songs, f, indent=4, sort_keys=True)
-            print("Wrote to %s" % destination)
+    # Saves or removes up to CONTAINS_BATCH tracks in a single request
+    def save_songs(self, ids):
+        self.request("PUT", "/me/tracks", params={ "ids": ",".join(ids) }).raise_for_status()
+
+    def remove_songs(self, ids):
+        self.request("DELETE", "/me/tracks", params={ "ids": ",".join(ids) }).raise_for_status()
+
+    # Downloads the whole library a page at a time, writing each page to
+    # |destination| as it arrives (see library.file_format) and staging it in
+    # |store|, which is only replaced once every page is in. Memory use doesn't
+    # grow with the library. If |checkpoint| is a file name, the position is
+    # recorded there after every page so that an interrupted run resumes where
+    # it stopped.
+    def cache_library(self, destination, jobs=1, store=None, checkpoint=None, log=False):
+        target = os.path.abspath(destination) if destination is not None else None
+        store_path = os.path.abspath(store.path) if store is not None else None
+        state = None
+        if checkpoint is not None and destination is not None:
+            try:
+                with open(checkpoint, "r") as f:
+                    state = json.load(f)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                pass
+            if state is not None and (state.get("destination") != target or state.get("store") != store_path
+                                      or not os.path.exists(destination) or os.path.getsize(destination) < state["size"]
+                                      or (store is not None and store.count_staged() != state["count"])):
+                state = None
+
+        if state is None:
+            state = { "destination": target, "store": store_path, "offset": 0, "count": 0, "size": 0, "added_at": None, "ids": [] }
+            writer = library.LibraryWriter(destination)
+            if store is not None:
+                store.clear_staged()
+            first = None
         else:
-            print(json.dumps(all_songs, indent=4, sort_keys=True))
+            writer = library.LibraryWriter(destination, state["size"], state["count"])
+            first = self.find_resume_page(state, log)
+            print("Resuming library cache from track %d" % state["count"])
+
+        for offset, page in self.library_pages(state["offset"], log, jobs, first):
+            items = [ s for s in page['items'] if not already_cached(state, s) ]
+            if store is not None:
+                store.stage(Track.from_saved_track(s, keep_raw=True) for s in items)
+            size = writer.write(items)
+            state["offset"] = offset + len(page['items'])
+            state["count"] = writer.count
+            if items:
+                newest = items[-1]['added_at']
+                same = [ s['track']['id'] for s in items if s['added_at'] == newest ]
+                state["ids"] = (state["ids"] if newest == state["added_at"] else []) + same
+                state["added_at"] = newest
+            if checkpoint is not None and size is not None:
+                state["size"] = size
+                with open(checkpoint + ".tmp", "w") as f:
+                    json.dump(state, f)
+                os.replace(checkpoint + ".tmp", checkpoint)
+
+        writer.close()
+        if store is not None:
+            store.commit_staged()
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        if destination is not None:
+            print("Wrote %d tracks to %s" % (state["count"], destination))
+
+    # Yields (offset, page) for the library pages from |offset| in order,
+    # fetching up to |jobs| at a time. |first| is the page at |offset| if it has
+    # already been fetched.
+    def library_pages(self, offset=0, log=False, jobs=1, first=None):
+        if first is None:
+            first = self.fetch_library_page(offset, log)
+        yield offset, first
+        offsets = range(offset + PAGE_SIZE, first['total'], PAGE_SIZE)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for i in range(0, len(offsets), jobs):
+                wave = offsets[i:i + jobs]
+                yield from zip(wave, pool.map(lambda o: self.fetch_library_page(o, log), wave))
+
+    # Tracks saved during an interrupted cache run push the rest down, which
+    # already_cached() skips over, but removed tracks pull them up past the
+    # checkpointed offset. So step back from the offset until a page starts
+    # with a track that was already written, and return that page.
+    def find_resume_page(self, state, log=False):
+        offset = state["offset"]
+        while True:
+            start = max(offset - 1, 0)
+            page = self.fetch_library_page(start, log)
+            if start == 0 or (page['items'] and already_cached(state, page['items'][0])):
+                state["offset"] = start
+                return page
+            offset -= PAGE_SIZE
 
-    def fetch_library(self, since=None, log=False, break_early=False):
-        headers = { "Authorization": "Bearer " + self.auth.oauth() }
-        params = { "offset": 0, "limit": 50 }
-        import urllib
-        uri = 'https://api.spotify.com/v1/me/tracks?' + urllib.parse.urlencode(params)
+    # With |keep_raw| the Tracks hold the saved track objects, as the library
+    # store needs to add them
+    def fetch_library(self, since=None, log=False, break_early=False, jobs=1, keep_raw=False):
+        if jobs > 1 and not break_early:
+            return self.fetch_library_parallel(since, log, jobs, keep_raw)
+        params = { "offset": 0, "limit": PAGE_SIZE }
+        uri = '/me/tracks?' + urllib.parse.urlencode(params)
         all_songs = []
         while uri != None:
             if log:
                 print("Request %s" % uri)
-            r = requests.get(uri, headers=headers)
-            if r.status_code == 200:
-                j = r.json()
-                new_songs = j['items']
-                if since is not None:
-                    filtered = [ s for s in new_songs if parse(s['added_at']) >= since ]
-                    all_songs.extend(filtered)
-                    if len(filtered) != len(new_songs):
-                        break
-                else:
-                    all_songs.extend(new_songs)
-                if 'next' in j and j['next'] != None:
-                    uri = j['next']
-                    params = None
-                else:
-                    uri = None
-            elif r.status_code == 401:
-                if log:
-                    print("Refreshing token")
-                self.auth.update_token()
-                headers = { "Authorization": "Bearer " + self.auth.oauth() }
-            elif r.status_code == 429:
-                if 'Retry-After' in r.headers:
-                    if log:
-                        print("Sleep for " + str(r.headers['Retry-After']))
-                    sleep(int(r.headers['Retry-After']))
+            r = self.request("GET", uri, log=log)
+            r.raise_for_status()
+            j = r.json()
+            if extend_since(all_songs, j['items'], since, keep_raw):
+                break
+            if 'next' in j and j['next'] != None:
+                uri = j['next']
+            else:
+                uri = None
             if break_early:
                 break
         return all_songs
 
-    def fetch_cached_library(self, library_src):
-        with open(library_src, "r") as f:
-            return json.load(f)
+    def fetch_library_page(self, offset, log=False):
+        if log:
+            print("Request offset %d" % offset)
+        r = self.request("GET", "/me/tracks", params={ "offset": offset, "limit": PAGE_SIZE }, log=log)
+        r.raise_for_status()
+        return r.json()
 
-    def update_library(self, library_file, log=False):
-        try:
-            with open(library_file, "r") as f:
-                library = json.load(f)
-        except FileNotFoundError:
-            library = []
-        except json.decoder.JSONDecodeError:
-            library = []
+    # Reads 'total' from the first page and then fetches the remaining pages
+    # on up to |jobs| threads, keeping them in library order
+    def fetch_library_parallel(self, since=None, log=False, jobs=4, keep_raw=False):
+        first = self.fetch_library_page(0, log)
+        all_songs = []
+        if extend_since(all_songs, first['items'], since, keep_raw):
+            return all_songs
+        offsets = range(PAGE_SIZE, first['total'], PAGE_SIZE)
+        # With |since| we don't know how many pages we need, so fetch them in
+        # waves of |jobs| and stop after the first wave that reaches it
+        wave = jobs if since is not None else max(len(offsets), 1)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for i in range(0, len(offsets), wave):
+                pages = pool.map(lambda offset: self.fetch_library_page(offset, log), offsets[i:i + wave])
+                for page in pages:
+                    if extend_since(all_songs, page['items'], since, keep_raw):
+                        return all_songs
+        return all_songs
+
+    # Fetches only the songs saved since the newest one in |store|, and with
+    # |reconcile| drops the songs that have been unsaved since
+    def update_library(self, store, log=False, jobs=1, reconcile=False):
+        most_recent = store.newest_added_at()
+        new_songs = self.fetch_library(most_recent, log, jobs=jobs, keep_raw=True)
+        store.upsert(new_songs)
+        if log:
+            print("Added %d new songs to library" % len(new_songs))
+        if reconcile:
+            self.reconcile_library(store, log)
+        return new_songs
+
+    # Removes the tracks in |store| that are no longer saved, fetching a few
+    # pages rather than the whole library. Both lists are newest first, so
+    # each unsaved track moves every later one up a position. The "shift" of
+    # a page is the local position of its first track that we have minus its
+    # position in the library. Both lists start together, so the shift at the
+    # start of page 0 is 0 (whatever was unsaved from the top), and the first
+    # page gives the total and so the shift at the end. Ranges of pages with
+    # the same shift at both ends can't have lost anything, and the rest are
+    # bisected down to single pages, whose local tracks are compared with the
+    # ones the API returned. Candidates are confirmed with tracks_contain
+    # before they are deleted, as tracks saved at the same time may be listed
+    # in a different order.
+    def reconcile_library(self, store, log=False):
+        local = store.track_ids()
+        positions = { track_id: i for i, track_id in enumerate(local) }
+        pages = {}
+
+        def page_ids(n):
+            if n not in pages:
+                pages[n] = [ item['track']['id'] for item in self.fetch_library_page(n * PAGE_SIZE, log)['items'] ]
+            return pages[n]
+
+        # Pages made up only of tracks we don't have (which update_library
+        # should rule out) are taken to have the shift of the range's start
+        def shift(n, default):
+            for i, track_id in enumerate(page_ids(n)):
+                if track_id in positions:
+                    return positions[track_id] - (n * PAGE_SIZE + i)
+            return default
 
-        most_recent = None
-        for saved_track in library:
-            d = parse(saved_track["added_at"])
-            if most_recent is None or d > most_recent:
-                most_recent = d
+        first = self.fetch_library_page(0, log)
+        pages[0] = [ item['track']['id'] for item in first['items'] ]
+        total = first['total']
+        page_count = (total + PAGE_SIZE - 1) // PAGE_SIZE
+        candidates = set()
 
-        new_songs = self.fetch_library(most_recent, log)
-        library.extend(new_songs)
-        library = sorted(library, key=itemgetter("added_at"), reverse=True)
+        # Looks for removals between the starts of pages |a| and |b|
+        def search(a, shift_a, b, shift_b):
+            if shift_a == shift_b:
+                return
+            if b - a == 1:
+                end = min(b * PAGE_SIZE, total) + shift_b
+                remote = set(page_ids(a))
+                candidates.update(t for t in local[max(a * PAGE_SIZE + shift_a, 0):end] if t not in remote)
+                return
+            mid = (a + b) // 2
+            shift_mid = shift(mid, shift_a)
+            search(a, shift_a, mid, shift_mid)
+            search(mid, shift_mid, b, shift_b)
 
-        with open(library_file, "w") as f:
-            json.dump(library, f, indent=4, sort_keys=True)
+        if page_count == 0:
+            candidates.update(local)
+        else:
+            search(0, 0, page_count, len(local) - total)
 
-        return library
+        candidates = sorted(candidates)
+        removed = [ t for t, saved in zip(candidates, self.tracks_contain(candidates)) if not saved ]
+        store.delete(removed)
+        if log:
+            print("Removed %d unsaved songs from library with %d page requests" % (len(removed), len(pages)))
+        return removed
 
     def get_user_id(self):
-        headers = { "Authorization" : "Bearer " + self.auth.oauth() }
-        uri = 'https://api.spotify.com/v1/me'
-        j = requests.get(uri, headers=headers).json()
-        return j['id']
-
-    def create_playlist(self, title, ids, public=False):
-        user_id = self.get_user_id()
-        headers = { "Authorization": "Bearer " + self.auth.oauth() }
-        uri = 'https://api.spotify.com/v1/users/%s/playlists' % user_id
-        playlist_res = requests.post(uri, headers=headers, json = {"name":title,"public":public}).json()
-        playlist_id = playlist_res['id']
-        print("Created playlist %s with id %s" % (title, playlist_id))
-        for ids_chunk in [ids[i:i + 100] for i in range(0, len(ids), 100)]:
-            uri = 'https://api.spotify.com/v1/users/%s/playlists/%s/tracks' % (user_id, playlist_id)
-            print(requests.post(uri, headers=headers, json={"uris":ids_chunk}).json())
+        if self.user_id is None:
+            self.user_id = self.request("GET", "/me").json()['id']
+        return self.user_id
+
+    # If |checkpoint| is a file name, progress is recorded after every chunk
+    # so that an interrupted upload of the same tracks resumes into the same
+    # playlist rather than starting again. Each upload (title and tracks) has
+    # a file of its own next to |checkpoint|, so that uploads running at once,
+    # e.g. in the daemon, don't overwrite each other's progress.
+    def create_playlist(self, title, ids, public=False, jobs=1, checkpoint=None, log=False):
+        digest = hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+        state = None
+        if checkpoint is not None:
+            root, ext = os.path.splitext(checkpoint)
+            key = hashlib.sha1((title + "\n" + digest).encode("utf-8")).hexdigest()
+            checkpoint = "%s-%s%s" % (root, key[:16], ext)
+            try:
+                with open(checkpoint, "r") as f:
+                    state = json.load(f)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                pass
+            if state is not None and (state.get("title") != title or state.get("digest") != digest):
+                state = None
+
+        if state is None:
+            uri = '/users/%s/playlists' % self.get_user_id()
+            playlist_res = self.request("POST", uri, json = {"name":title,"public":public}).json()
+            state = { "title": title, "digest": digest, "playlist_id": playlist_res['id'], "committed": 0 }
+            print("Created playlist %s with id %s" % (title, state["playlist_id"]))
+        else:
+            # Chunks land in order, so the playlist's length is exactly how many
+            # tracks were committed, even if we died before recording the last
+            r = self.request("GET", '/playlists/%s' % state["playlist_id"], params={ "fields": "tracks.total" })
+            r.raise_for_status()
+            state["committed"] = r.json()["tracks"]["total"]
+            print("Resuming playlist %s with id %s from track %d" % (title, state["playlist_id"], state["committed"]))
+
+        def on_commit(committed):
+            state["committed"] = committed
+            if checkpoint is not None:
+                with open(checkpoint + ".tmp", "w") as f:
+                    json.dump(state, f)
+                os.replace(checkpoint + ".tmp", checkpoint)
+
+        on_commit(state["committed"])
+        self.add_to_playlist(state["playlist_id"], ids, state["committed"], jobs, on_commit, log)
+        if checkpoint is not None:
+            try:
+                os.remove(checkpoint)
+            except FileNotFoundError:
+                pass
         print("Added {} tracks".format(len(ids)))
+        return state["playlist_id"]
+
+    # Adds |uris[start:]| to the end of a playlist that already holds
+    # |uris[:start]|, uploading up to |jobs| chunks at once. Every chunk has an
+    # explicit position, which the API rejects while it is past the end of the
+    # playlist, so chunks can only be applied in order; one that arrives
+    # before its predecessor is retried once the predecessor has landed.
+    # |on_commit| is called in order with the number of tracks now in place.
+    def add_to_playlist(self, playlist_id, uris, start=0, jobs=1, on_commit=None, log=False):
+        uri = '/playlists/%s/tracks' % playlist_id
+        starts = list(range(start, len(uris), PLAYLIST_CHUNK))
+        sent = { s: threading.Event() for s in starts }
+        committed = { s: threading.Event() for s in starts }
+        failed = []
+
+        def upload(s):
+            chunk = uris[s:s + PLAYLIST_CHUNK]
+            prev = s - PLAYLIST_CHUNK if s > start else None
+            try:
+                if prev is not None:
+                    sent[prev].wait()
+                sent[s].set()
+                while not failed:
+                    # Only a 400 for a request sent before the predecessor
+                    # landed can be down to the order they arrived in
+                    early = prev is not None and not committed[prev].is_set()
+                    r = self.request("POST", uri, json={ "uris": chunk, "position": s }, log=log)
+                    if r.status_code in (200, 201):
+                        break
+                    if r.status_code == 400 and early:
+                        committed[prev].wait()
+                        continue
+                    r.raise_for_status()
+                if prev is not None:
+                    committed[prev].wait()
+                if failed:
+                    return
+                if log:
+                    print("Added tracks %d-%d" % (s, s + len(chunk)))
+                if on_commit is not None:
+                    on_commit(s + len(chunk))
+            except Exception as e:
+                failed.append(e)
+                sent[s].set()
+            finally:
+                committed[s].set()
 
-    def create_singles_playlist(self, limit, title, library_src, dry_run=False, log=False):
-        all_songs = self.update_library(library_src, log)
-        album_to_songs = {}
-        song_id_to_song = {}
-        for song in all_songs:
-            song_id = song['track']['id']
-            song_id_to_song[song_id] = song
-            album_id = song['track']['album']['id']
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            list(pool.map(upload, starts))
+        if failed:
+            raise failed[0]
 
-            if album_id not in album_to_songs:
-                album_to_songs[album_id] = set()
-            album_to_songs[album_id].add(song_id)
+    def fetch_playlist(self, playlist_id):
+        r = self.request("GET", '/playlists/%s' % playlist_id, params={ "fields": "snapshot_id" })
+        r.raise_for_status()
+        snapshot_id = r.json()["snapshot_id"]
+        params = { "offset": 0, "limit": PLAYLIST_CHUNK, "fields": "items(track(uri)),next" }
+        uri = '/playlists/%s/tracks?' % playlist_id + urllib.parse.urlencode(params)
+        uris = []
+        while uri != None:
+            r = self.request("GET", uri)
+            r.raise_for_status()
+            j = r.json()
+            uris.extend(item["track"]["uri"] for item in j["items"] if item["track"] is not None)
+            uri = j.get("next")
+        return snapshot_id, uris
+
+    # Makes an existing playlist hold exactly |uris|, in order, by applying only
+    # the edits needed. If those would take more requests than replacing the
+    # playlist outright then it is replaced instead.
+    def sync_playlist(self, playlist_id, uris, log=False):
+        snapshot_id, current = self.fetch_playlist(playlist_id)
+        removals, moves, additions = playlist_diff(current, uris)
+        chunks = lambda n: (n + PLAYLIST_CHUNK - 1) // PLAYLIST_CHUNK
+        edit_cost = chunks(len(removals)) + len(moves) + sum(chunks(len(a[1])) for a in additions)
+        replace_cost = max(chunks(len(uris)), 1)
+        print("Syncing playlist %s: %d to remove, %d to move, %d to add" %
+              (playlist_id, len(removals), len(moves), sum(len(a[1]) for a in additions)))
+        uri = '/playlists/%s/tracks' % playlist_id
+
+        if edit_cost > replace_cost:
+            if log:
+                print("Replacing playlist contents")
+            self.request("PUT", uri, json={ "uris": uris[:PLAYLIST_CHUNK] }).raise_for_status()
+            self.add_to_playlist(playlist_id, uris, min(PLAYLIST_CHUNK, len(uris)), log=log)
+            return
 
-        single_songs = []
-        playlist_songs = []
+        # Remove from the end so that earlier positions stay valid
+        removals.sort(key=lambda r: r[1], reverse=True)
+        for i in range(0, len(removals), PLAYLIST_CHUNK):
+            tracks = [ { "uri": u, "positions": [ p ] } for u, p in removals[i:i + PLAYLIST_CHUNK] ]
+            r = self.request("DELETE", uri, json={ "tracks": tracks, "snapshot_id": snapshot_id })
+            r.raise_for_status()
+            snapshot_id = r.json()["snapshot_id"]
+        for range_start, insert_before in moves:
+            body = { "range_start": range_start, "insert_before": insert_before, "snapshot_id": snapshot_id }
+            r = self.request("PUT", uri, json=body)
+            r.raise_for_status()
+            snapshot_id = r.json()["snapshot_id"]
+        for position, added in additions:
+            for i in range(0, len(added), PLAYLIST_CHUNK):
+                r = self.request("POST", uri, json={ "uris": added[i:i + PLAYLIST_CHUNK], "position": position + i })
+                r.raise_for_status()
+        if log:
+            print("Synced playlist with %d edit requests" % edit_cost)
 
-        for album_id in album_to_songs:
-            if len(album_to_songs[album_id]) <= limit:
-                for song_id in album_to_songs[album_id]:
-                    single_songs.append("spotify:track:" + song_id)
-                    playlist_songs.append(song_id_to_song[song_id])
+    def create_singles_playlist(self, limit, title, store, dry_run=False, log=False, jobs=1, checkpoint=None, sync=None, reconcile=False):
+        self.update_library(store, log, jobs, reconcile)
+        playlist_songs = query.singles(store, limit)
+        single_songs = [ song['uri'] for song in playlist_songs ]
 
         title = title + " " + strftime("%Y-%m-%d", localtime())
         width = shutil.get_terminal_size().columns
         if dry_run:
             print(title)
             for song in playlist_songs:
-                print(songfmt.format_song(songfmt.simple_song_obj(song), width, include_time=False, include_pos=False))
+                print(songfmt.format_song(song, width, include_time=False, include_pos=False))
+        elif sync is not None:
+            self.sync_playlist(sync, single_songs, log)
         else:
-            self.create_playlist(title, single_songs)
+            self.create_playlist(title, single_songs, jobs=jobs, checkpoint=checkpoint, log=log)
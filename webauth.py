@@ -1,14 +1,29 @@
-import requests, requests.auth
+import requests.auth
+import stats
+import threading
+import transport
+from time import time
 from os.path import expanduser, join
-from flask import Flask, abort, request
+from transport import ACCOUNTS_ROOT
 
 REDIRECT_URI = "http://localhost:3000/callback"
 
+# Refresh this many seconds before the token actually expires so that requests
+# in flight don't race the expiry
+EXPIRY_MARGIN = 60
+
 class WebAuth:
 
-    def __init__(self, config, config_dir):
+    def __init__(self, config, config_dir, http=None):
         self.config = config
         self.config_dir = config_dir
+        self.http = http if http is not None else transport.shared()
+        # The token file is only read once; afterwards tokens live in memory.
+        # |_lock| makes refreshes single-flight across threads.
+        self._lock = threading.Lock()
+        self._token = None
+        self._refresh_token = None
+        self._expires_at = None
 
     def client_id(self):
         return self.config['WEB_API']['CLIENT_ID']
@@ -16,9 +31,6 @@ class WebAuth:
     def client_secret(self):
         return self.config['WEB_API']['CLIENT_SECRET']
 
-    def serve(self):
-        self.app.run(port=3000)
-
     def get_token(self, code):
         client_auth = requests.auth.HTTPBasicAuth(self.client_id(), self.client_secret())
         post_data = {
@@ -27,31 +39,73 @@ class WebAuth:
                         "grant_type": "authorization_code"
                     }
         try:
-            response = requests.post("https://accounts.spotify.com/api/token", auth=client_auth, data=post_data)
+            response = self.http.post(ACCOUNTS_ROOT + "/api/token", auth=client_auth, data=post_data)
             token_json = response.json()
-            return token_json["access_token"], token_json["refresh_token"]
+            return token_json["access_token"], token_json["refresh_token"], token_json.get("expires_in")
         except:
             return None
 
     def token_file_name(self):
         return join(self.config_dir, 'usertoken.txt')
 
-    def update_token(self):
-        refresh_token = self.get_refresh_token()
-        token = self.get_new_token(refresh_token)
-        if token != None:
-            f = open(self.token_file_name(), "w")
-            f.write(token + '\n')
-            f.write(refresh_token)
-            f.close()
-            return token
-        return None
+    # The token file holds the access token, the refresh token and, if known,
+    # the time at which the access token expires (seconds since the epoch)
+    def load_tokens(self):
+        lines = open(self.token_file_name(), 'r').read().split('\n')
+        self._token = lines[0].strip()
+        self._refresh_token = lines[1].strip()
+        if len(lines) > 2 and lines[2].strip():
+            self._expires_at = float(lines[2])
+        else:
+            self._expires_at = None
+
+    def store_tokens(self, token, refresh_token, expires_in=None):
+        expires_at = time() + expires_in if expires_in else None
+        f = open(self.token_file_name(), "w")
+        f.write(token + '\n')
+        f.write(refresh_token)
+        if expires_at is not None:
+            f.write('\n' + str(expires_at))
+        f.close()
+        self._token = token
+        self._refresh_token = refresh_token
+        self._expires_at = expires_at
+
+    # |stale| is the token that the caller saw fail. If another thread (or
+    # process) has already replaced it then that token is returned rather than
+    # refreshing again.
+    def update_token(self, stale=None):
+        with self._lock:
+            self.load_tokens()
+            if stale is not None and self._token != stale:
+                return self._token
+            refresh_token = self._refresh_token
+            with stats.phase("token refresh"):
+                res = self.get_new_token(refresh_token)
+            if res != None:
+                token, expires_in, new_refresh_token = res
+                self.store_tokens(token, new_refresh_token or refresh_token, expires_in)
+                return token
+            return None
 
     def get_refresh_token(self):
-        return  open(self.token_file_name(), 'r').read().split('\n')[1].strip()
+        if self._refresh_token is None:
+            with self._lock:
+                if self._refresh_token is None:
+                    self.load_tokens()
+        return self._refresh_token
 
     def oauth(self):
-        return open(self.token_file_name(), 'r').read().split('\n')[0].strip()
+        token = self._token
+        if token is None:
+            with self._lock:
+                if self._token is None:
+                    self.load_tokens()
+                token = self._token
+        expires_at = self._expires_at
+        if expires_at is not None and time() > expires_at - EXPIRY_MARGIN:
+            return self.update_token(token) or token
+        return token
 
     def get_new_token(self, refresh_token):
         try:
@@ -60,9 +114,9 @@ class WebAuth:
                             "grant_type": "refresh_token",
                             "refresh_token": refresh_token
                         }
-            resp = requests.post("https://accounts.spotify.com/api/token", auth=client_auth, data=post_data)
+            resp = self.http.post(ACCOUNTS_ROOT + "/api/token", auth=client_auth, data=post_data)
             token_json = resp.json()
-            return token_json["access_token"]
+            return token_json["access_token"], token_json.get("expires_in"), token_json.get("refresh_token")
         except:
             return None
 
@@ -86,7 +140,7 @@ class WebAuth:
                         "state": state
                      }
             import urllib
-            return 'https://accounts.spotify.com/authorize?' + urllib.parse.urlencode(params)
+            return ACCOUNTS_ROOT + '/authorize?' + urllib.parse.urlencode(params)
 
         @app.route('/callback')
         def callback():
@@ -96,11 +150,10 @@ class WebAuth:
             state = request.args.get('state', '')
             # TODO: Verify the state, if not abort
             code = request.args.get('code')
-            f = open(self.token_file_name(), "w")
-            token, refresh_token = self.get_token(code)
-            f.write(token + '\n')
-            f.write(refresh_token)
-            f.close()
+            tokens = self.get_token(code)
+            if tokens is None:
+                return "Error: could not fetch a token"
+            self.store_tokens(*tokens)
             return "Thanks! Rerun Ravenglass to interact with the Spotify API"
 
         print("Open a browser at http://localhost:3000 and follow the instructions")